@@ -0,0 +1,388 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import discord
+
+from fake_discord import FakeDiscord
+
+# Offline benchmarks for Moogly, run against a local fake of the Discord HTTP API
+# with interactions dispatched straight into the bot's connection state.
+#
+# python benchmarks/bench.py                       run every scenario and check thresholds.json
+# python benchmarks/bench.py -s maps_join_burst    run a single scenario
+# python benchmarks/bench.py --latency 50          add 50ms to every fake API call
+# python benchmarks/bench.py --update-thresholds   write the current results (with headroom) as new thresholds
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+THRESHOLDS_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'thresholds.json')
+
+GUILD_ID = 900000000000000001
+ADMIN_ROLE_ID = 900000000000000010
+NEWCOMER_ROLE_ID = 900000000000000011
+SEVENTH_HAVEN_ROLE_ID = 900000000000000012
+FC_FRIEND_ROLE_ID = 900000000000000013
+MAPS_ROLE_ID = 900000000000000014
+EVENTS_CHANNEL_ID = 900000000000000020
+LOGS_CHANNEL_ID = 900000000000000021
+ADMISSION_CHANNEL_ID = 900000000000000022
+ADMIN_USER_ID = 900000000000000030
+
+# Import moogly with a throwaway config and database
+def load_moogly(workdir):
+    config = {
+        'token': 'benchmark-token',
+        'guild_id': GUILD_ID,
+        'prefix': '!',
+        'database': os.path.join(workdir, 'moogly.db'),
+        'administrator_role_id': ADMIN_ROLE_ID,
+        'newcomer_role_id': NEWCOMER_ROLE_ID,
+        'seventh_haven_role_id': SEVENTH_HAVEN_ROLE_ID,
+        'fc_friend_role_id': FC_FRIEND_ROLE_ID,
+        'maps_notifications_role_id': MAPS_ROLE_ID,
+        'events_channel_id': EVENTS_CHANNEL_ID,
+        'logs_channel_id': LOGS_CHANNEL_ID,
+        'admission_channel_id': ADMISSION_CHANNEL_ID,
+    }
+    config_path = os.path.join(workdir, 'config.json')
+    with open(config_path, 'w') as f:
+        json.dump(config, f)
+
+    os.environ['MOOGLY_CONFIG'] = config_path
+    sys.path.insert(0, ROOT)
+    import moogly
+    return moogly
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+class Harness:
+    def __init__(self, moogly, fake):
+        self.moogly = moogly
+        self.bot = moogly.bot
+        self.fake = fake
+        self.guild = None
+
+    async def start(self):
+        await self.fake.start()
+        discord.http.Route.BASE = self.fake.base_url
+        for channel_id in (EVENTS_CHANNEL_ID, LOGS_CHANNEL_ID, ADMISSION_CHANNEL_ID):
+            self.fake.add_channel(channel_id)
+
+        # login() runs setup_hook, the gateway is never connected
+        await self.bot.login('benchmark-token')
+
+        state = self.bot._connection
+        self.guild = discord.Guild(data=self.fake.guild_payload([
+            (GUILD_ID, '@everyone', 0),
+            (ADMIN_ROLE_ID, 'Administrator', 8),
+            (NEWCOMER_ROLE_ID, 'Newcomer', 0),
+            (SEVENTH_HAVEN_ROLE_ID, 'Seventh Haven', 0),
+            (FC_FRIEND_ROLE_ID, 'FC Friend', 0),
+            (MAPS_ROLE_ID, 'Maps', 0),
+        ]), state=state)
+        state._add_guild(self.guild)
+
+        # Member chunk requests normally go over the gateway, answer them from the fake's members
+        async def query_members(guild, query, limit, user_ids, cache, presences):
+            self.fake.calls['GATEWAY request_guild_members'] = self.fake.calls.get('GATEWAY request_guild_members', 0) + 1
+            members = [discord.Member(data=self.fake.members[user_id], guild=guild, state=state) for user_id in user_ids if user_id in self.fake.members]
+            if cache:
+                for member in members:
+                    guild._add_member(member)
+            return members
+        state.query_members = query_members
+        self.add_member(ADMIN_USER_ID, roles=[ADMIN_ROLE_ID])
+
+    async def stop(self):
+        await self.bot.close()
+        await self.fake.stop()
+
+    def add_member(self, user_id, roles=(), cached=True):
+        payload = self.fake.add_member(user_id, roles)
+        if cached:
+            self.guild._add_member(discord.Member(data=payload, guild=self.guild, state=self.bot._connection))
+
+    # Dispatch an interaction like the gateway would, returns its id
+    def dispatch(self, user_id, interaction_type, data, message=None, channel_id=None):
+        payload = self.fake.interaction_payload(self.bot.application_id, user_id, interaction_type, data, message=message, channel_id=channel_id)
+        self.dispatched[int(payload['id'])] = time.perf_counter()
+        self.bot._connection.parse_interaction_create(payload)
+        return int(payload['id'])
+
+    def click(self, user_id, custom_id, message, channel_id):
+        return self.dispatch(user_id, 3, {'custom_id': custom_id, 'component_type': 2}, message=message, channel_id=channel_id)
+
+    # Run a prefix command as if the user had sent it in the channel
+    async def command(self, user_id, content, channel_id):
+        payload = self.fake.message_payload(channel_id, self.fake.snowflake(), {'content': content})
+        payload['author'] = self.fake.user_payload(user_id)
+        payload['member'] = self.fake.members[user_id]
+        payload['guild_id'] = str(GUILD_ID)
+        message = discord.Message(state=self.bot._connection, channel=self.guild.get_channel(channel_id), data=payload)
+        await self.bot.process_commands(message)
+
+    async def latencies(self, interaction_ids):
+        results = []
+        for interaction_id in interaction_ids:
+            answered_at, _ = await self.fake.wait_callback(interaction_id)
+            results.append((answered_at - self.dispatched[interaction_id]) * 1000)
+        return results
+
+    async def wait_jobs(self, timeout=120):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            row = await self.bot.db.fetchone("SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running')")
+            if row[0] == 0:
+                return
+            await asyncio.sleep(0.01)
+        raise TimeoutError('job queue did not drain')
+
+    # Deferred interactions finish in the background after being acknowledged
+    async def wait_interactions(self, timeout=120):
+        deadline = time.monotonic() + timeout
+        while self.bot.interaction_tasks:
+            if time.monotonic() > deadline:
+                raise TimeoutError('deferred interactions did not complete')
+            await asyncio.sleep(0.01)
+
+    # Only the scenario itself is measured, its data is prepared beforehand
+    async def run(self, prepare, scenario):
+        context = await prepare(self) if prepare else {}
+        self.dispatched = {}
+        self.fake.reset_counters()
+        tracemalloc.start()
+        started = time.perf_counter()
+        result = await scenario(self, **context)
+        result['elapsed_s'] = time.perf_counter() - started
+        result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+        result['rest_calls_per_op'] = self.fake.total_calls() / result['ops']
+        result['rate_limited'] = self.fake.rate_limited
+        result['throughput'] = result['ops'] / result.pop('busy_s', result['elapsed_s'])
+        result['p50_ms'] = percentile(result['latencies'], 50)
+        result['p99_ms'] = percentile(result['latencies'], 99)
+        result['calls'] = dict(sorted(self.fake.calls.items()))
+        del result['latencies']
+        return result
+
+# 50 users clicking Join on the same run at once, repeated over several runs
+async def maps_join_burst(harness, rounds=10, users=50):
+    latencies = []
+    busy = 0
+    next_user = 800000000000000000
+    for _ in range(rounds):
+        message_id = harness.fake.snowflake()
+        message = harness.fake.message_payload(EVENTS_CHANNEL_ID, message_id, {'components': [{'type': 1, 'components': [{'type': 2, 'style': 3, 'label': 'Join', 'custom_id': 'join_map_run'}]}]})
+        harness.fake.messages[message_id] = message
+        await harness.bot.db.execute(
+            'INSERT INTO maps_runs (message_id, discord_timestamp, timestamp, message, available_slots, pinged, guild_id) VALUES (?, ?, ?, ?, ?, 0, ?)',
+            (message_id, '<t:0:F>', time.time() + 86400, 'Benchmark run', 8, GUILD_ID)
+        )
+
+        started = time.perf_counter()
+        interaction_ids = []
+        for _ in range(users):
+            next_user += 1
+            interaction_ids.append(harness.click(next_user, 'join_map_run', message, EVENTS_CHANNEL_ID))
+        latencies += await harness.latencies(interaction_ids)
+        busy += time.perf_counter() - started
+
+    # Let pending embed edits go out so they are counted
+    while harness.bot.embed_updates.tasks:
+        await asyncio.sleep(0.05)
+    return {'ops': rounds * users, 'latencies': latencies, 'busy_s': busy}
+
+# A flood of applications: button, modal submit, then an administrator approves each one
+async def application_flood(harness, applicants=200):
+    latencies = []
+    users = [700000000000000000 + index for index in range(applicants)]
+    for user_id in users:
+        harness.add_member(user_id, roles=[NEWCOMER_ROLE_ID], cached=False)
+    form = harness.fake.message_payload(ADMISSION_CHANNEL_ID, harness.fake.snowflake())
+
+    # Everyone opens the modal at once
+    clicks = [harness.click(user_id, 'ApplicationMessage:seventh_haven_button', form, ADMISSION_CHANNEL_ID) for user_id in users]
+    latencies += await harness.latencies(clicks)
+
+    submits = []
+    for user_id, interaction_id in zip(users, clicks):
+        _, body = harness.fake.callbacks[interaction_id]
+        modal = body['data']
+        text_input = modal['components'][0]['components'][0]
+        submits.append(harness.dispatch(user_id, 5, {
+            'custom_id': modal['custom_id'],
+            'components': [{'type': 1, 'components': [{'type': 4, 'custom_id': text_input['custom_id'], 'value': f'Name{user_id} Benchmark'}]}],
+        }, channel_id=ADMISSION_CHANNEL_ID))
+    latencies += await harness.latencies(submits)
+    await harness.wait_interactions()
+
+    # Approve every admission message that was posted
+    admissions = [message for message in harness.fake.messages.values() if message['channel_id'] == str(ADMISSION_CHANNEL_ID) and '(ID: ' in message['content']]
+    approvals = [harness.click(ADMIN_USER_ID, 'AdmissionMessage:approve_button', message, ADMISSION_CHANNEL_ID) for message in admissions]
+    latencies += await harness.latencies(approvals)
+    await harness.wait_interactions()
+    await harness.wait_jobs()
+    return {'ops': applicants, 'latencies': latencies}
+
+# Applications waiting after an event, approved with a single command
+async def prepare_bulk_applications(harness, applicants=200):
+    users = [650000000000000000 + index for index in range(applicants)]
+    for user_id in users:
+        harness.add_member(user_id, roles=[NEWCOMER_ROLE_ID], cached=False)
+    await harness.bot.db.executemany(
+        'INSERT INTO applications (guild_id, user_id, fc, ingame_name, message_id) VALUES (?, ?, ?, ?, ?)',
+        [(GUILD_ID, user_id, 'Seventh Haven', f'Name{user_id} Benchmark', harness.fake.snowflake()) for user_id in users]
+    )
+    return {'applicants': applicants}
+
+async def application_bulk_approve(harness, applicants):
+    started = time.perf_counter()
+    await harness.command(ADMIN_USER_ID, '!application_approve_all', ADMISSION_CHANNEL_ID)
+    command_ms = (time.perf_counter() - started) * 1000
+    await harness.wait_jobs()
+    return {'ops': applicants, 'latencies': [command_ms]}
+
+# 100k stored runs, most of them finished, with a batch of reminders due right away
+async def prepare_reminders(harness, runs=100000, due=100, participants=8):
+    now = time.time()
+    base_id = 600000000000000000
+
+    def populate(conn):
+        conn.executemany(
+            'INSERT INTO maps_runs (message_id, discord_timestamp, timestamp, message, available_slots, pinged, guild_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(base_id + index, '<t:0:F>', now - 86400 if index >= due else now + 3600, 'Benchmark run', 0, 1 if index >= due else 0, GUILD_ID) for index in range(runs)]
+        )
+        conn.executemany(
+            'INSERT INTO maps_run_participants (message_id, user_id, joined_at) VALUES (?, ?, ?)',
+            [(base_id + index, 500000000000000000 + slot, now) for index in range(runs) for slot in range(participants)]
+        )
+        conn.executemany(
+            'INSERT INTO maps_run_reminders (message_id, minutes_before, timestamp, pinged) VALUES (?, 20, ?, ?)',
+            [(base_id + index, now - 86400 - 1200 if index >= due else now, 1 if index >= due else 0) for index in range(runs)]
+        )
+    await harness.bot.db.write(populate)
+    for slot in range(participants):
+        harness.add_member(500000000000000000 + slot)
+    harness.bot.scheduler.stop()
+    return {'due': due}
+
+async def reminders_100k(harness, due):
+    # The scheduler reload is the only part of startup that depends on how many runs are stored
+    started = time.perf_counter()
+    await harness.bot.scheduler.load()
+    load_ms = (time.perf_counter() - started) * 1000
+
+    harness.bot.scheduler.start()
+    while len(harness.fake.posted) < due:
+        await asyncio.sleep(0.01)
+
+    # Latency of a reminder is how long after being due it was posted
+    latencies = [(posted_at - started) * 1000 for posted_at, _ in harness.fake.posted]
+    return {'ops': due, 'latencies': latencies, 'scheduler_load_ms': load_ms, 'busy_s': time.perf_counter() - started}
+
+SCENARIOS = {
+    'maps_join_burst': (None, maps_join_burst),
+    'application_flood': (None, application_flood),
+    'application_bulk_approve': (prepare_bulk_applications, application_bulk_approve),
+    'reminders_100k': (prepare_reminders, reminders_100k),
+}
+
+CHECKS = [
+    ('p99_ms', 'max'),
+    ('rest_calls_per_op', 'max'),
+    ('peak_mb', 'max'),
+    ('throughput', 'min'),
+    ('scheduler_load_ms', 'max'),
+]
+
+# Discord drops an interaction that isn't answered within 3 seconds, whatever the headroom
+INTERACTION_SCENARIOS = {'maps_join_burst', 'application_flood'}
+INTERACTION_DEADLINE_MS = 2900
+
+def limit_for(name, metric, limit):
+    if metric == 'p99_ms' and name in INTERACTION_SCENARIOS:
+        return min(limit, INTERACTION_DEADLINE_MS)
+    return limit
+
+def check(name, result, thresholds):
+    failures = []
+    for metric, kind in CHECKS:
+        limit = thresholds.get(name, {}).get(metric)
+        if limit is None or metric not in result:
+            continue
+        limit = limit_for(name, metric, limit)
+        if (kind == 'max' and result[metric] > limit) or (kind == 'min' and result[metric] < limit):
+            failures.append(f"{name}: {metric}={result[metric]:.2f} ({kind} {limit})")
+    return failures
+
+def report(name, result):
+    print(f"== {name}")
+    print(f"   ops={result['ops']} elapsed={result['elapsed_s']:.2f}s throughput={result['throughput']:.1f} ops/s")
+    print(f"   p50={result['p50_ms']:.2f}ms p99={result['p99_ms']:.2f}ms peak={result['peak_mb']:.1f}MB")
+    print(f"   rest calls/op={result['rest_calls_per_op']:.2f} rate limited={result['rate_limited']}")
+    if 'scheduler_load_ms' in result:
+        print(f"   scheduler load={result['scheduler_load_ms']:.1f}ms")
+    for route, count in result['calls'].items():
+        print(f"     {count:6d}  {route}")
+
+async def main(args):
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s %(name)s: %(message)s')
+    # Rate limit warnings are expected, they are counted by the fake server instead
+    logging.getLogger('discord').setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as workdir:
+        moogly = load_moogly(workdir)
+        harness = Harness(moogly, FakeDiscord(GUILD_ID, latency=args.latency / 1000))
+        await harness.start()
+        results = {}
+        try:
+            for name in args.scenario or SCENARIOS:
+                results[name] = await harness.run(*SCENARIOS[name])
+                report(name, results[name])
+        finally:
+            await harness.stop()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    if args.update_thresholds:
+        thresholds = {}
+        for name, result in results.items():
+            thresholds[name] = {}
+            for metric, kind in CHECKS:
+                if metric not in result:
+                    continue
+                # REST call counts are deterministic, they only get a little slack
+                headroom = 1.1 if metric == 'rest_calls_per_op' else args.headroom
+                thresholds[name][metric] = limit_for(name, metric, round(result[metric] * (headroom if kind == 'max' else 1 / headroom), 2))
+        with open(THRESHOLDS_PATH, 'w') as f:
+            json.dump(thresholds, f, indent=4)
+        print(f"Thresholds written to {THRESHOLDS_PATH}")
+        return 0
+
+    with open(THRESHOLDS_PATH, 'r') as f:
+        thresholds = json.load(f)
+    failures = [failure for name, result in results.items() for failure in check(name, result, thresholds)]
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline Moogly benchmarks')
+    parser.add_argument('-s', '--scenario', action='append', choices=list(SCENARIOS), help='scenario to run, can be repeated (default: all)')
+    parser.add_argument('--latency', type=float, default=0, help='added latency of every fake API call, in milliseconds')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--update-thresholds', action='store_true', help='store the results as the new thresholds')
+    parser.add_argument('--headroom', type=float, default=3.0, help='factor applied to results when updating thresholds')
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,256 @@
+from aiohttp import web
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+
+import discord
+
+# discord.py only decodes bodies whose content type is exactly application/json
+def json_response(data, status=200, headers=None):
+    return web.Response(body=json.dumps(data).encode(), status=status, headers={**(headers or {}), 'Content-Type': 'application/json'})
+
+# Local stand-in for the Discord HTTP API, just enough of it for Moogly's code
+# paths. Every request is counted per route, interaction callbacks are recorded
+# with their arrival time and message edits are rate limited per channel like
+# the real API does.
+class FakeDiscord:
+    def __init__(self, guild_id, latency=0.0, edit_limit=(5, 5.0)):
+        self.guild_id = guild_id
+        self.latency = latency
+        self.edit_limit = edit_limit
+        self.last_snowflake = 0
+        self.bot_user = self.user_payload(self.snowflake(), 'Moogly')
+        self.bot_user['bot'] = True
+
+        self.calls = {}
+        self.posted = []
+        self.rate_limited = 0
+        self.callbacks = {}
+        self.callback_waiters = {}
+        self.messages = {}
+        self.channels = {}
+        self.members = {}
+        self.edit_buckets = {}
+
+        self.app = web.Application()
+        self.app.router.add_route('*', '/api/v10/{path:.*}', self.handle)
+        self.runner = None
+        self.base_url = None
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f'http://127.0.0.1:{port}/api/v10'
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    def reset_counters(self):
+        self.calls.clear()
+        self.posted.clear()
+        self.rate_limited = 0
+
+    def total_calls(self, include_callbacks=True):
+        return sum(count for route, count in self.calls.items() if include_callbacks or not route.startswith('POST /interactions'))
+
+    # Snowflakes carry their creation time like real ones, the bot checks interaction ages
+    def snowflake(self):
+        self.last_snowflake = max(self.last_snowflake + 1, discord.utils.time_snowflake(datetime.now(timezone.utc)))
+        return self.last_snowflake
+
+    # Payload builders
+    @staticmethod
+    def user_payload(user_id, name=None):
+        return {'id': str(user_id), 'username': name or f'user{user_id}', 'discriminator': '0', 'global_name': None, 'avatar': None}
+
+    def member_payload(self, user_id, roles=(), permissions=0):
+        return {
+            'user': self.user_payload(user_id),
+            'roles': [str(role_id) for role_id in roles],
+            'joined_at': datetime.now(timezone.utc).isoformat(),
+            'deaf': False,
+            'mute': False,
+            'nick': None,
+            'flags': 0,
+            'permissions': str(permissions),
+        }
+
+    def channel_payload(self, channel_id):
+        return {'id': str(channel_id), 'type': 0, 'guild_id': str(self.guild_id), 'name': f'channel-{channel_id}', 'position': 0, 'permission_overwrites': [], 'nsfw': False, 'parent_id': None}
+
+    def guild_payload(self, roles):
+        return {
+            'id': str(self.guild_id),
+            'name': 'Benchmark guild',
+            'icon': None,
+            'owner_id': self.bot_user['id'],
+            'roles': [
+                {'id': str(role_id), 'name': name, 'permissions': str(permissions), 'position': position, 'color': 0, 'hoist': False, 'managed': False, 'mentionable': False}
+                for position, (role_id, name, permissions) in enumerate(roles)
+            ],
+            'emojis': [],
+            'stickers': [],
+            'features': [],
+            'channels': [self.channel_payload(channel_id) for channel_id in self.channels],
+            'member_count': 1,
+        }
+
+    def message_payload(self, channel_id, message_id, body=None):
+        body = body or {}
+        return {
+            'id': str(message_id),
+            'channel_id': str(channel_id),
+            'author': self.bot_user,
+            'content': body.get('content') or '',
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'edited_timestamp': None,
+            'tts': False,
+            'mention_everyone': False,
+            'mentions': [],
+            'mention_roles': [],
+            'attachments': [],
+            'embeds': body.get('embeds') or [],
+            'components': body.get('components') or [],
+            'pinned': False,
+            'type': 0,
+        }
+
+    def add_channel(self, channel_id):
+        self.channels[channel_id] = self.channel_payload(channel_id)
+
+    def add_member(self, user_id, roles=(), permissions=0):
+        self.members[user_id] = self.member_payload(user_id, roles, permissions)
+        return self.members[user_id]
+
+    # Interactions
+    def interaction_payload(self, application_id, user_id, interaction_type, data, message=None, channel_id=None):
+        interaction_id = self.snowflake()
+        member = self.members.get(user_id) or self.member_payload(user_id)
+        payload = {
+            'id': str(interaction_id),
+            'application_id': str(application_id),
+            'type': interaction_type,
+            'token': f'token-{interaction_id}',
+            'version': 1,
+            'guild_id': str(self.guild_id),
+            'channel_id': str(channel_id) if channel_id else None,
+            'member': member,
+            'data': data,
+            'locale': 'en-US',
+            'guild_locale': 'en-US',
+            'app_permissions': '0',
+        }
+        if channel_id:
+            payload['channel'] = self.channel_payload(channel_id)
+        if message is not None:
+            payload['message'] = message
+        return payload
+
+    async def wait_callback(self, interaction_id, timeout=30):
+        if interaction_id not in self.callbacks:
+            future = self.callback_waiters.setdefault(interaction_id, asyncio.get_running_loop().create_future())
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        return self.callbacks[interaction_id]
+
+    # Request handling
+    def rate_limit(self, key):
+        limit, period = self.edit_limit
+        now = time.monotonic()
+        bucket = [sent for sent in self.edit_buckets.get(key, []) if sent > now - period]
+        if len(bucket) >= limit:
+            self.edit_buckets[key] = bucket
+            return bucket[0] + period - now
+        bucket.append(now)
+        self.edit_buckets[key] = bucket
+        return 0
+
+    async def handle(self, request):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        path = request.match_info['path']
+        parts = path.split('/')
+        method = request.method
+        route = self.route_name(method, parts)
+        self.calls[route] = self.calls.get(route, 0) + 1
+
+        body = None
+        if request.can_read_body and request.content_type == 'application/json':
+            body = await request.json()
+
+        if route == 'PATCH /channels/{id}/messages/{id}':
+            retry_after = self.rate_limit(parts[1])
+            if retry_after > 0:
+                self.rate_limited += 1
+                return json_response(
+                    {'message': 'You are being rate limited.', 'retry_after': retry_after, 'global': False},
+                    status=429,
+                    # Without a Via header discord.py takes the 429 for a Cloudflare ban and gives up
+                    headers={'Retry-After': str(retry_after), 'X-RateLimit-Scope': 'user', 'Via': '1.1 google'},
+                )
+
+        response = self.respond(route, parts, body)
+        if response is None:
+            return web.Response(status=204)
+        if isinstance(response, web.Response):
+            return response
+        return json_response(response)
+
+    @staticmethod
+    def route_name(method, parts):
+        parts = [part if not part.isdigit() else '{id}' for part in parts]
+        if parts[0] in ('interactions', 'webhooks') and len(parts) > 2:
+            parts[2] = '{token}'
+        return method + ' /' + '/'.join(parts)
+
+    def respond(self, route, parts, body):
+        if route == 'GET /users/@me':
+            return self.bot_user
+        if route == 'GET /oauth2/applications/@me':
+            return {
+                'id': self.bot_user['id'], 'name': 'Moogly', 'icon': None, 'description': '', 'rpc_origins': [],
+                'bot_public': True, 'bot_require_code_grant': False, 'owner': self.user_payload(1), 'summary': '',
+                'verify_key': '0' * 64, 'flags': 0, 'team': None,
+            }
+        if route == 'POST /interactions/{id}/{token}/callback':
+            interaction_id = int(parts[1])
+            self.callbacks[interaction_id] = (time.perf_counter(), body)
+            waiter = self.callback_waiters.pop(interaction_id, None)
+            if waiter and not waiter.done():
+                waiter.set_result(None)
+            return None
+        if route in ('PATCH /webhooks/{id}/{token}/messages/@original', 'POST /webhooks/{id}/{token}'):
+            return self.message_payload(0, self.snowflake(), body)
+        if route == 'GET /channels/{id}':
+            channel = self.channels.get(int(parts[1]))
+            return channel or json_response({'message': 'Unknown Channel', 'code': 10003}, status=404)
+        if route == 'POST /channels/{id}/messages':
+            message = self.message_payload(parts[1], self.snowflake(), body)
+            self.messages[int(message['id'])] = message
+            self.posted.append((time.perf_counter(), int(parts[1])))
+            return message
+        if route == 'PATCH /channels/{id}/messages/{id}':
+            message = self.messages.get(int(parts[3])) or self.message_payload(parts[1], parts[3])
+            message.update({key: value for key, value in (body or {}).items() if key in ('content', 'embeds', 'components')})
+            return message
+        if route in ('DELETE /channels/{id}/messages/{id}', 'POST /channels/{id}/messages/bulk-delete'):
+            return None
+        if route == 'GET /guilds/{id}/members/{id}':
+            member = self.members.get(int(parts[3]))
+            return member or json_response({'message': 'Unknown Member', 'code': 10007}, status=404)
+        if route == 'PATCH /guilds/{id}/members/{id}':
+            member = self.members.get(int(parts[3])) or self.member_payload(int(parts[3]))
+            member['nick'] = (body or {}).get('nick', member.get('nick'))
+            return member
+        if route in ('PUT /guilds/{id}/members/{id}/roles/{id}', 'DELETE /guilds/{id}/members/{id}/roles/{id}'):
+            return None
+        if route == 'GET /users/{id}':
+            return self.user_payload(int(parts[1]))
+        if route == 'POST /users/@me/channels':
+            recipient = self.user_payload(int(body['recipient_id']))
+            return {'id': str(self.snowflake()), 'type': 1, 'recipients': [recipient], 'last_message_id': None}
+        return json_response({'message': f'Not implemented by the fake server: {route}', 'code': 0}, status=404)
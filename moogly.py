@@ -1,134 +1,1621 @@
 import discord
 from discord.ext import commands, tasks
+from aiohttp import web
+import asyncio
+import bisect
+import contextlib
+import difflib
+import functools
+import glob
+import gzip
+import heapq
 import json
+import logging
+import math
+import queue
 import sqlite3
+import threading
+import time
 import traceback
 import os
-from datetime import datetime, timezone, timedelta
+import re
+import unicodedata
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+# In-process metrics: latency histograms, counters and gauges, exposed in the
+# Prometheus text format and summarized by !stats
+class Metrics:
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name, seconds, **labels):
+        histogram = self.histograms.get(self.key(name, labels))
+        if histogram is None:
+            # One count per bucket, then +Inf, then the sum of observed values
+            histogram = self.histograms[self.key(name, labels)] = [0] * (len(self.BUCKETS) + 2)
+        histogram[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+
+    def increment(self, name, value=1, **labels):
+        key = self.key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    # Gauges are either set directly or computed at scrape time from a callable
+    def gauge(self, name, value, **labels):
+        self.gauges[self.key(name, labels)] = value
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.increment('moogly_errors_total', source=name, **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def format_labels(labels, extra=()):
+        labels = list(labels) + list(extra)
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{key}="{str(value)}"' for key, value in labels) + '}'
+
+    # Approximate quantile from the buckets, good enough to spot a slow handler
+    def quantile(self, histogram, q):
+        count = sum(histogram[:-1])
+        if not count:
+            return 0.0
+        cumulative = 0
+        for bound, bucket_count in zip(self.BUCKETS + (float('inf'),), histogram[:-1]):
+            cumulative += bucket_count
+            if cumulative >= q * count:
+                return bound
+        return float('inf')
+
+    def render(self):
+        lines = []
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.BUCKETS + (float('inf'),), histogram[:-1]):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{name}_bucket{self.format_labels(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{self.format_labels(labels)} {histogram[-1]}")
+            lines.append(f"{name}_count{self.format_labels(labels)} {cumulative}")
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{name}{self.format_labels(labels)} {value}")
+        for (name, labels), value in sorted(self.gauges.items()):
+            lines.append(f"{name}{self.format_labels(labels)} {value() if callable(value) else value}")
+        return '\n'.join(lines) + '\n'
+
+    async def serve(self, host, port):
+        async def handle(request):
+            return web.Response(text=self.render(), content_type='text/plain')
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        print(f"Serving metrics on http://{host}:{port}/metrics")
+        return runner
+
+# Counts discord.py's rate limit warnings, the library retries 429s by itself
+class RateLimitCounter(logging.Handler):
+    def __init__(self, metrics):
+        super().__init__(level=logging.WARNING)
+        self.metrics = metrics
+
+    def emit(self, record):
+        if 'rate limited' in record.getMessage():
+            self.metrics.increment('moogly_rate_limited_total')
+
+# Resident set size in bytes, None where /proc is not available
+def resident_memory():
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+# Time an interaction callback, used under the discord.ui decorators
+def instrumented(callback):
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        with bot.metrics.timer('moogly_interaction_seconds', handler=callback.__qualname__):
+            return await callback(*args, **kwargs)
+    return wrapper
+
+# Acknowledge an interaction right away and finish the callback in the background,
+# whatever the callback returns is sent to the user as an ephemeral followup
+def deferred(callback):
+    @functools.wraps(callback)
+    async def wrapper(self, interaction: discord.Interaction, *args):
+        name = callback.__qualname__
+        try:
+            await interaction.response.defer(ephemeral=True, thinking=True)
+        except discord.NotFound:
+            # Discord already dropped the interaction, the user saw "interaction failed"
+            bot.report_deadline_miss(interaction.guild_id, name, f"could not be acknowledged after {bot.interaction_age(interaction):.1f}s")
+            return
+        age = bot.interaction_age(interaction)
+        if age > 3:
+            bot.report_deadline_miss(interaction.guild_id, name, f"was acknowledged after {age:.1f}s")
+        bot.run_interaction(interaction, callback(self, interaction, *args), name)
+    return wrapper
+
+# SQLite access layer: every write goes through a single writer thread which groups
+# queued statements into one transaction, reads are served by a small pool of
+# connections. Nothing here blocks the event loop.
+class Database:
+    def __init__(self, path, readers=4, batch_size=64, metrics=None):
+        self.path = path
+        self.metrics = metrics
+        self.batch_size = batch_size
+        self.write_queue = queue.Queue()
+        self.local = threading.local()
+        self.read_conns = []
+        self.read_conns_lock = threading.Lock()
+
+        self.writer_conn = self.connect()
+        # Incremental auto-vacuum lets maintenance give freed pages back in small steps,
+        # databases created before it was enabled need one full VACUUM to switch
+        if self.writer_conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            self.writer_conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            self.writer_conn.execute('VACUUM')
+        self.writer_conn.execute('PRAGMA journal_mode=WAL')
+        self.writer_conn.execute('PRAGMA synchronous=NORMAL')
+
+        self.read_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='moogly-db-read')
+        self.writer_thread = threading.Thread(target=self.writer_loop, name='moogly-db-writer', daemon=True)
+        self.writer_thread.start()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA busy_timeout=5000')
+        return conn
+
+    def writer_loop(self):
+        running = True
+        while running:
+            job = self.write_queue.get()
+            if job is None:
+                break
+
+            # Group everything already waiting in the queue into the same commit
+            batch = [job]
+            while len(batch) < self.batch_size:
+                try:
+                    job = self.write_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    running = False
+                    break
+                batch.append(job)
+            try:
+                self.run_batch(batch)
+            except Exception as e:
+                # Last resort, the writer thread must outlive any batch
+                traceback.print_exception(type(e), e, e.__traceback__)
+
+        self.writer_conn.close()
+
+    def run_batch(self, batch):
+        # Jobs whose caller was cancelled while queued are skipped, the others can't be cancelled anymore
+        batch = [(fn, future) for fn, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        results = []
+        conn = self.writer_conn
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for fn, future in batch:
+                # A savepoint per job so one failing statement doesn't discard the whole batch
+                conn.execute('SAVEPOINT job')
+                try:
+                    result = fn(conn)
+                except Exception as e:
+                    conn.execute('ROLLBACK TO job')
+                    conn.execute('RELEASE job')
+                    results.append((future, None, e))
+                else:
+                    conn.execute('RELEASE job')
+                    results.append((future, result, None))
+            conn.execute('COMMIT')
+        except Exception as e:
+            # The transaction itself failed (database locked past busy_timeout, failed commit...), so does every job in it
+            self.rollback()
+            results = [(future, None, e) for _, future in batch]
+
+        for future, result, error in results:
+            try:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+            except Exception as e:
+                print(f"Failed to deliver a database result: {e!r}")
+
+    def rollback(self):
+        try:
+            if self.writer_conn.in_transaction:
+                self.writer_conn.execute('ROLLBACK')
+        except sqlite3.Error as e:
+            print(f"Rollback failed: {e!r}")
+
+    def read_conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.connect()
+            conn.execute('PRAGMA query_only=1')
+            self.local.conn = conn
+            with self.read_conns_lock:
+                self.read_conns.append(conn)
+        return conn
+
+    # Run fn(conn) on the writer thread, inside a transaction
+    async def write(self, fn):
+        future = Future()
+        with self.timer('write'):
+            self.write_queue.put((fn, future))
+            return await asyncio.wrap_future(future)
+
+    # Run fn(conn) on one of the read connections
+    async def read(self, fn):
+        loop = asyncio.get_running_loop()
+        with self.timer('read'):
+            return await loop.run_in_executor(self.read_executor, lambda: fn(self.read_conn()))
+
+    def timer(self, op):
+        if self.metrics is None:
+            return contextlib.nullcontext()
+        return self.metrics.timer('moogly_db_seconds', op=op)
+
+    async def execute(self, sql, params=()):
+        return await self.write(lambda conn: conn.execute(sql, params).rowcount)
+
+    async def executemany(self, sql, params):
+        return await self.write(lambda conn: conn.executemany(sql, params).rowcount)
+
+    async def fetchone(self, sql, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchall())
+
+    # Flush pending writes and close every connection
+    def close(self):
+        self.write_queue.put(None)
+        self.writer_thread.join()
+        self.read_executor.shutdown(wait=True)
+        with self.read_conns_lock:
+            for conn in self.read_conns:
+                conn.close()
+            self.read_conns.clear()
+
+# Fires maps run reminders at their exact due time. Pending reminders live in a
+# min-heap of (due timestamp, message_id, minutes_before) loaded once at startup;
+# the task sleeps until the earliest one or until a new reminder is scheduled.
+class RunScheduler:
+    def __init__(self, bot, max_attempts=5):
+        self.bot = bot
+        self.max_attempts = max_attempts
+        self.heap = []
+        self.attempts = {}
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    async def load(self):
+        reminders = await self.bot.db.fetchall('SELECT timestamp, message_id, minutes_before FROM maps_run_reminders WHERE pinged=0 ORDER BY timestamp')
+        # Of the reminders that came due while the bot was offline only the latest one per run
+        # fires, same as schedule_reminders skipping past offsets
+        now = time.time()
+        overdue = {}
+        superseded = []
+        self.heap = []
+        for due, message_id, minutes_before in reminders:
+            if due > now:
+                self.heap.append((due, message_id, minutes_before))
+                continue
+            if message_id in overdue:
+                superseded.append((message_id, overdue[message_id][2]))
+            overdue[message_id] = (due, message_id, minutes_before)
+        self.heap.extend(overdue.values())
+        heapq.heapify(self.heap)
+        if superseded:
+            await self.bot.db.executemany('UPDATE maps_run_reminders SET pinged=1 WHERE message_id=? AND minutes_before=?', superseded)
+            print(f"Skipped {len(superseded)} maps run reminders superseded while offline")
+        print(f"Loaded {len(self.heap)} pending maps run reminders")
+
+    def schedule(self, due, message_id, minutes_before):
+        heapq.heappush(self.heap, (due, message_id, minutes_before))
+        self.wakeup.set()
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        while True:
+            delay = self.heap[0][0] - time.time() if self.heap else None
+            if delay is not None and delay <= 0:
+                due, message_id, minutes_before = heapq.heappop(self.heap)
+                try:
+                    await self.bot.send_reminder(message_id, minutes_before)
+                except Exception as e:
+                    await self.failed(message_id, minutes_before, e)
+                else:
+                    self.attempts.pop((message_id, minutes_before), None)
+                continue
+
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    # Transient errors are retried a minute later, up to max_attempts. A missing channel,
+    # missing permissions or an unconfigured guild won't fix themselves, the reminder is dropped.
+    async def failed(self, message_id, minutes_before, error):
+        key = (message_id, minutes_before)
+        self.attempts[key] = self.attempts.get(key, 0) + 1
+        permanent = isinstance(error, (KeyError, discord.NotFound, discord.Forbidden))
+        if not permanent and self.attempts[key] < self.max_attempts:
+            print(f"Failed to send reminder for maps run {message_id}, retrying in a minute: {error!r}")
+            heapq.heappush(self.heap, (time.time() + 60, message_id, minutes_before))
+            return
+
+        self.attempts.pop(key, None)
+        self.bot.metrics.increment('moogly_reminders_dropped_total')
+        print(f"Giving up on the {minutes_before} minutes reminder of maps run {message_id} after {error!r}")
+        try:
+            await self.bot.mark_reminder_sent(message_id, minutes_before)
+        except Exception as e:
+            print(f"Failed to mark reminder of maps run {message_id} as sent: {e!r}")
+
+# Resolves channels, members and users from the gateway cache first and only falls
+# back to REST on a miss. REST results are kept for ttl seconds, configured
+# channels are pinned for the lifetime of the bot.
+class ResolverCache:
+    def __init__(self, bot, ttl=300):
+        self.bot = bot
+        self.ttl = ttl
+        self.channels = {}
+        self.members = {}
+        self.users = {}
+        self.pinned_channels = set()
+
+    def get_entry(self, entries, key):
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del entries[key]
+            return None
+        return value
+
+    def set_entry(self, entries, key, value, ttl=None):
+        entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+
+    async def channel(self, channel_id):
+        channel = self.bot.get_channel(channel_id) or self.get_entry(self.channels, channel_id)
+        if channel is None:
+            channel = await self.bot.fetch_channel(channel_id)
+            self.set_entry(self.channels, channel_id, channel)
+        return channel
+
+    async def member(self, guild, user_id):
+        member = guild.get_member(user_id) or self.get_entry(self.members, (guild.id, user_id))
+        if member is None:
+            try:
+                member = await guild.fetch_member(user_id)
+            except discord.NotFound:
+                return None
+            self.set_entry(self.members, (guild.id, user_id), member)
+        return member
+
+    # Members seen in interactions and commands are kept, so a small member cache
+    # still serves the lookups that follow them
+    def remember_member(self, member):
+        if isinstance(member, discord.Member) and member.guild.get_member(member.id) is None:
+            self.set_entry(self.members, (member.guild.id, member.id), member)
+
+    # The member attached to a guild interaction is already up to date, no lookup needed
+    async def interaction_member(self, interaction):
+        if isinstance(interaction.user, discord.Member):
+            self.remember_member(interaction.user)
+            return interaction.user
+        return await self.member(interaction.guild, interaction.user.id)
+
+    async def user(self, user_id):
+        user = self.bot.get_user(user_id) or self.get_entry(self.users, user_id)
+        if user is None:
+            try:
+                user = await self.bot.fetch_user(user_id)
+            except discord.NotFound:
+                return None
+            self.set_entry(self.users, user_id, user)
+        return user
+
+    async def pin_channels(self, channel_ids):
+        for channel_id in channel_ids:
+            try:
+                channel = self.bot.get_channel(channel_id) or await self.bot.fetch_channel(channel_id)
+            except discord.HTTPException as e:
+                print(f"Failed to resolve channel {channel_id}: {e}")
+                continue
+            self.set_entry(self.channels, channel_id, channel, ttl=float('inf'))
+            self.pinned_channels.add(channel_id)
+
+    # Resolve many members at once: cache first, then chunked gateway queries (or
+    # REST fetches without the members intent) run concurrently, at most `concurrency` at a time
+    async def resolve_members(self, guild, user_ids, concurrency=4):
+        resolved = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            member = guild.get_member(user_id) or self.get_entry(self.members, (guild.id, user_id))
+            if member is None:
+                missing.append(user_id)
+            else:
+                resolved[user_id] = member
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def query(chunk):
+            async with semaphore:
+                try:
+                    return await guild.query_members(user_ids=chunk, limit=len(chunk), cache=True)
+                except asyncio.TimeoutError:
+                    return []
+
+        async def fetch(user_id):
+            async with semaphore:
+                return await self.member(guild, user_id)
+
+        if missing and self.bot.intents.members:
+            chunks = [missing[start:start + 100] for start in range(0, len(missing), 100)]
+            members = [member for result in await asyncio.gather(*[query(chunk) for chunk in chunks]) for member in result]
+        else:
+            members = [member for member in await asyncio.gather(*[fetch(user_id) for user_id in missing]) if member]
+
+        for member in members:
+            self.set_entry(self.members, (guild.id, member.id), member)
+            resolved[member.id] = member
+        return [resolved.get(user_id) for user_id in user_ids]
+
+    def invalidate_channel(self, channel_id, channel=None):
+        if channel is not None and channel_id in self.pinned_channels:
+            self.set_entry(self.channels, channel_id, channel, ttl=float('inf'))
+        else:
+            self.channels.pop(channel_id, None)
+            self.pinned_channels.discard(channel_id)
+
+    def invalidate_member(self, guild_id, user_id):
+        self.members.pop((guild_id, user_id), None)
+        self.users.pop(user_id, None)
+
+    # Expired entries are otherwise only dropped when they are looked up again
+    def purge(self):
+        now = time.monotonic()
+        for entries in (self.channels, self.members, self.users):
+            for key in [key for key, (expires, _) in entries.items() if expires < now]:
+                del entries[key]
+
+# Role and channel ids every guild needs, set with !settings_set
+GUILD_SETTINGS = (
+    'administrator_role_id',
+    'newcomer_role_id',
+    'seventh_haven_role_id',
+    'fc_friend_role_id',
+    'maps_notifications_role_id',
+    'events_channel_id',
+    'logs_channel_id',
+    'admission_channel_id',
+)
+
+# Per-guild settings from the guild_settings table, kept in memory until they are
+# changed. A guild is always handled by the process running its shard, so dropping
+# the cached entry on change is enough. The guild from config.json (guild_id, or the
+# guild owning events_channel_id) and rows stored before guild_id existed (guild_id 0)
+# fall back to the config values.
+class GuildSettings:
+    def __init__(self, bot):
+        self.bot = bot
+        self.cache = {}
+        self.legacy_guild_id = bot.config.get('guild_id')
+
+    def defaults(self, guild_id):
+        if guild_id == 0 or guild_id == self.legacy_guild_id:
+            return {key: self.bot.config[key] for key in GUILD_SETTINGS if key in self.bot.config}
+        return {}
+
+    async def get(self, guild_id):
+        settings = self.cache.get(guild_id)
+        if settings is None:
+            rows = await self.bot.db.fetchall('SELECT key, value FROM guild_settings WHERE guild_id=?', (guild_id,))
+            settings = {**self.defaults(guild_id), **{row['key']: row['value'] for row in rows}}
+            self.cache[guild_id] = settings
+        return settings
+
+    # A None value is stored as a NULL row, which also masks the config.json default
+    async def set(self, guild_id, key, value):
+        await self.bot.db.execute('INSERT OR REPLACE INTO guild_settings (guild_id, key, value) VALUES (?, ?, ?)', (guild_id, key, value))
+        self.cache.pop(guild_id, None)
+
+    # Drop the stored value, the guild falls back to its default again
+    async def reset(self, guild_id, key):
+        await self.bot.db.execute('DELETE FROM guild_settings WHERE guild_id=? AND key=?', (guild_id, key))
+        self.cache.pop(guild_id, None)
+
+    # Find the guild config.json was written for and hand it the rows stored without a guild
+    async def claim_legacy(self):
+        if self.legacy_guild_id is None:
+            channel = self.bot.get_channel(self.bot.config.get('events_channel_id', 0))
+            if channel is None or not hasattr(channel, 'guild'):
+                return
+            self.legacy_guild_id = channel.guild.id
+            self.cache.pop(self.legacy_guild_id, None)
+        claimed = await self.bot.db.write(lambda conn: sum(
+            conn.execute(f'UPDATE {table} SET guild_id=? WHERE guild_id=0', (self.legacy_guild_id,)).rowcount
+            for table in ('maps_runs', 'maps_runs_archive', 'applications', 'applications_archive')
+        ))
+        # Active runs were loaded in setup_hook, before the rows could be claimed
+        self.bot.maps_runs.claim_legacy(self.legacy_guild_id)
+        if claimed:
+            print(f"Assigned {claimed} rows stored before multi-guild support to guild {self.legacy_guild_id}")
+
+# Lookup tables for one dyes_<lang>.json file, built once at startup. Names are
+# normalized (case, accents, spaces and punctuation ignored) and indexed in both
+# directions, with a sorted key list for prefix matches and a fuzzy fallback for typos.
+class DyeIndex:
+    def __init__(self, lang, entries):
+        self.lang = lang
+        self.names = {}
+        for entry in entries:
+            original_name, translated_name = entry['original_name'], entry['translated_name']
+            self.names.setdefault(self.normalize(original_name), (translated_name, original_name))
+            self.names.setdefault(self.normalize(translated_name), (original_name, translated_name))
+        self.keys = sorted(self.names)
+        self.prefixes_by_length = {}
+        # Bounded, every unknown string sent to !translate_dyes would stay in it otherwise
+        self.lookup = functools.lru_cache(maxsize=4096)(self.lookup)
+
+    @staticmethod
+    def normalize(name):
+        name = unicodedata.normalize('NFKD', name).casefold()
+        return ''.join(char for char in name if char.isalnum())
+
+    # Returns (name, counterpart name) or None if nothing matches
+    def lookup(self, name):
+        key = self.normalize(name)
+        if not key:
+            return None
+
+        match = self.names.get(key)
+        if match is None:
+            # Unique prefix, e.g. "snow white" for "Snow White Dye"
+            start = bisect.bisect_left(self.keys, key)
+            candidates = []
+            for candidate in self.keys[start:start + 2]:
+                if candidate.startswith(key):
+                    candidates.append(candidate)
+            # "black" is not Black Urushi when Jet Black Dye exists, the key must not appear in any other name
+            if len(candidates) == 1 and not any(key in other for other in self.keys if set(self.names[other]) != set(self.names[candidates[0]])):
+                match = self.names[candidates[0]]
+        if match is None:
+            close = difflib.get_close_matches(key, self.keys, n=1, cutoff=0.8)
+            if close:
+                match = self.names[close[0]]
+        if match is None and len(key) >= 8:
+            # Typo in a name given without its "Dye" suffix, e.g. "jet blakc" against the
+            # "jetblack" prefix of "jetblackdye". Ambiguous prefixes don't count, and short
+            # ones are left out since one letter off is already 20% of the word.
+            prefixes = self.prefixes(len(key))
+            close = difflib.get_close_matches(key, prefixes, n=1, cutoff=0.8)
+            if close and len(prefixes[close[0]]) == 1:
+                match = next(iter(prefixes[close[0]]))
+        return match
+
+    # Key prefixes of one length mapped to the names they start, built once per length
+    def prefixes(self, length):
+        prefixes = self.prefixes_by_length.get(length)
+        if prefixes is None:
+            prefixes = {}
+            for key in self.keys:
+                prefixes.setdefault(key[:length], set()).add(self.names[key])
+            self.prefixes_by_length[length] = prefixes
+        return prefixes
+
+    # Translates every name in one pass, returns ({(name, counterpart): count}, [unknown names])
+    def translate(self, names):
+        counts = {}
+        unknown = []
+        for name in names:
+            match = self.lookup(name)
+            if match is None:
+                if name.strip():
+                    unknown.append(name.strip())
+                continue
+            counts[match] = counts.get(match, 0) + 1
+        return counts, unknown
+
+# Folds bursts of embed changes on a message into at most one edit per window. The
+# embed is rendered at send time from the in-memory state, so the edit always
+# carries the latest state no matter how many changes were requested.
+class EmbedCoalescer:
+    def __init__(self, window=1.0):
+        self.window = window
+        self.pending = {}
+        self.tasks = {}
+
+    def request(self, message, render):
+        self.pending[message.id] = (message, render)
+        if message.id not in self.tasks:
+            self.tasks[message.id] = asyncio.create_task(self.run(message.id))
+
+    async def run(self, message_id):
+        try:
+            while message_id in self.pending:
+                await asyncio.sleep(self.window)
+                await self.send(message_id)
+        finally:
+            self.tasks.pop(message_id, None)
+
+    async def send(self, message_id):
+        message, render = self.pending.pop(message_id)
+        try:
+            await message.edit(**render())
+        except discord.HTTPException as e:
+            print(f"Failed to update message {message_id}: {e}")
+
+    # Send every pending edit right away, used on shutdown
+    async def flush(self):
+        for task in list(self.tasks.values()):
+            task.cancel()
+        for message_id in list(self.pending):
+            await self.send(message_id)
+
+# Maps runs kept in memory as the source of truth for joins and embed rendering.
+# Active runs are loaded at startup, others on first use, and dropped once archived.
+# Joins are applied here first and written to SQLite in batches a moment later
+# (write-behind), a crash loses at most write_delay seconds of joins.
+class MapsRunStore:
+    def __init__(self, bot, write_delay=1.0, batch_size=256):
+        self.bot = bot
+        self.write_delay = write_delay
+        self.batch_size = batch_size
+        self.runs = {}
+        self.loading = {}
+        self.joins = []
+        self.dirty = set()
+        self.lock = asyncio.Lock()
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    async def load_active(self):
+        runs = await self.bot.db.read(MapsRun.load_active)
+        for maps_run in runs:
+            self.runs.setdefault(maps_run.message_id, maps_run)
+        print(f"Loaded {len(runs)} active maps runs")
+
+    # Concurrent misses for the same run share a single query
+    async def get(self, message_id):
+        maps_run = self.runs.get(message_id)
+        if maps_run is not None:
+            return maps_run
+        loader = self.loading.get(message_id)
+        if loader is None:
+            loader = asyncio.ensure_future(self.bot.db.read(lambda conn: MapsRun.load(conn, message_id)))
+            self.loading[message_id] = loader
+            loader.add_done_callback(lambda _: self.loading.pop(message_id, None))
+        maps_run = await loader
+        if maps_run is None:
+            return None
+        return self.runs.setdefault(message_id, maps_run)
+
+    def add(self, maps_run):
+        self.runs[maps_run.message_id] = maps_run
+
+    def claim_legacy(self, guild_id):
+        for maps_run in self.runs.values():
+            if maps_run.guild_id == 0:
+                maps_run.guild_id = guild_id
+
+    # Called with the lock held once the run is archived, its pending writes would only leave orphan rows
+    def discard(self, message_id):
+        self.runs.pop(message_id, None)
+        self.dirty.discard(message_id)
+
+    # Returns the join status, the database catches up on the next flush
+    def join(self, maps_run, user_id):
+        status = maps_run.join(user_id)
+        if status == 'joined':
+            self.joins.append((maps_run.message_id, user_id, maps_run.participants[user_id]))
+            self.dirty.add(maps_run.message_id)
+            if len(self.joins) >= self.batch_size:
+                self.wakeup.set()
+        return status
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    # Waits for the loop to exit so a batch it had taken is back in self.joins for the final flush
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.write_delay)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            return await self.flush_locked()
+
+    # Returns False if the batch couldn't be written. Joins on a run that was archived
+    # in the meantime (a handler still holding the MapsRun) are dropped.
+    async def flush_locked(self):
+        if not self.joins and not self.dirty:
+            return True
+        joins = [join for join in self.joins if join[0] in self.runs]
+        slots = [(self.runs[message_id].available_slots, message_id) for message_id in self.dirty if message_id in self.runs]
+        self.joins = []
+        self.dirty = set()
+        try:
+            with self.bot.metrics.timer('moogly_maps_run_flush_seconds'):
+                await self.bot.db.write(lambda conn: self._flush(conn, joins, slots))
+        except BaseException as e:
+            # Keep the batch, it goes out with the next flush. A cancelled write may have been
+            # skipped by the writer or still run, writing it twice is harmless.
+            self.joins = joins + self.joins
+            self.dirty.update(message_id for _, message_id in slots)
+            if not isinstance(e, Exception):
+                raise
+            print(f"Failed to write {len(joins)} maps run joins: {e!r}")
+            return False
+        return True
+
+    @staticmethod
+    def _flush(conn, joins, slots):
+        conn.executemany('INSERT OR IGNORE INTO maps_run_participants (message_id, user_id, joined_at) VALUES (?, ?, ?)', joins)
+        conn.executemany('UPDATE maps_runs SET available_slots=? WHERE message_id=?', slots)
+
+# Durable queue for outbound side effects (role edits, nicknames, log posts, DMs).
+# Jobs are stored in the jobs table so a restart doesn't lose them, run by a fixed
+# number of workers, retried with exponential backoff and deduplicated by key.
+class JobQueue:
+    def __init__(self, bot, handlers, workers=4, max_attempts=5, poll_interval=30):
+        self.bot = bot
+        self.handlers = handlers
+        self.worker_count = workers
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.workers = []
+        self.wakeup = asyncio.Event()
+        self.generation = 0
+        self.paused_until = 0
+        self.depth = 0
+
+    # Insert jobs from inside a database transaction, jobs are (kind, payload, dedup_key)
+    @staticmethod
+    def add(conn, jobs):
+        now = time.time()
+        conn.executemany(
+            'INSERT OR IGNORE INTO jobs (kind, payload, dedup_key, run_at) VALUES (?, ?, ?, ?)',
+            [(kind, json.dumps(payload), dedup_key, now) for kind, payload, dedup_key in jobs]
+        )
 
-class BotClient(commands.Bot):
-    def __init__(self, config, dyes_fr):
+    async def enqueue(self, jobs):
+        await self.bot.db.write(lambda conn: self.add(conn, jobs))
+        self.notify()
+
+    def notify(self):
+        self.generation += 1
+        self.wakeup.set()
+
+    def start(self):
+        if not self.workers:
+            self.workers = [asyncio.create_task(self.worker()) for _ in range(self.worker_count)]
+
+    def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+
+    # Jobs left running by a previous process are picked up again
+    async def recover(self):
+        recovered = await self.bot.db.execute("UPDATE jobs SET status='pending' WHERE status='running'")
+        pending = await self.bot.db.fetchone("SELECT COUNT(*) FROM jobs WHERE status='pending'")
+        print(f"Loaded {pending[0]} pending jobs ({recovered} recovered)")
+
+    @staticmethod
+    def _claim(conn):
+        now = time.time()
+        job = conn.execute("SELECT id, kind, payload, attempts FROM jobs WHERE status='pending' AND run_at<=? ORDER BY run_at LIMIT 1", (now,)).fetchone()
+        if job:
+            conn.execute("UPDATE jobs SET status='running' WHERE id=?", (job['id'],))
+            return job, None
+        next_run = conn.execute("SELECT MIN(run_at) FROM jobs WHERE status='pending'").fetchone()[0]
+        return None, next_run
+
+    async def worker(self):
+        while True:
+            job = None
+            try:
+                delay = self.paused_until - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                generation = self.generation
+                job, next_run = await self.bot.db.write(self._claim)
+                if job:
+                    await self.run(job)
+                    continue
+                if generation != self.generation:
+                    continue
+
+                # Polls even when idle, jobs committed without a notify() (an interaction
+                # cancelled right after its transaction) would wait for an unrelated enqueue
+                self.wakeup.clear()
+                timeout = self.poll_interval if next_run is None else min(max(next_run - time.time(), 0), self.poll_interval)
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except Exception as e:
+                # Keep the worker alive, a locked database must not stop the queue for good
+                print(f"Job worker error, retrying in {self.poll_interval}s: {e!r}")
+                traceback.print_exception(type(e), e, e.__traceback__)
+                await asyncio.sleep(self.poll_interval)
+                if job:
+                    await self.release(job)
+
+    # Puts a job the worker failed to finish back in the queue
+    async def release(self, job):
+        try:
+            await self.bot.db.execute("UPDATE jobs SET status='pending' WHERE id=? AND status='running'", (job['id'],))
+            self.notify()
+        except Exception as e:
+            print(f"Failed to release job {job['id']}, it runs again after a restart: {e!r}")
+
+    async def run(self, job):
+        try:
+            payload = json.loads(job['payload'])
+        except ValueError as e:
+            await self.fail(job, {}, e)
+            return
+        try:
+            with self.bot.metrics.timer('moogly_job_seconds', kind=job['kind']):
+                await self.handlers[job['kind']](payload)
+        except (discord.Forbidden, discord.NotFound) as e:
+            # Retrying won't help, give up right away
+            await self.fail(job, payload, e)
+        except Exception as e:
+            attempts = job['attempts'] + 1
+            self.bot.metrics.increment('moogly_job_retries_total', kind=job['kind'])
+            if attempts >= self.max_attempts:
+                await self.fail(job, payload, e)
+                return
+
+            delay = min(5 * 2 ** attempts, 600)
+            if isinstance(e, discord.HTTPException) and e.status == 429:
+                # Rate limited: hold every worker until the bucket resets
+                retry_after = float(e.response.headers.get('Retry-After', delay))
+                self.bot.metrics.increment('moogly_rate_limited_total')
+                self.paused_until = max(self.paused_until, time.time() + retry_after)
+                delay = retry_after
+            await self.bot.db.execute(
+                "UPDATE jobs SET status='pending', attempts=?, run_at=?, last_error=? WHERE id=?",
+                (attempts, time.time() + delay, repr(e), job['id'])
+            )
+            self.notify()
+        else:
+            await self.bot.db.execute("UPDATE jobs SET status='done', attempts=attempts+1 WHERE id=?", (job['id'],))
+
+    async def fail(self, job, payload, error):
+        print(f"Job {job['id']} ({job['kind']}) failed: {error!r}")
+        self.bot.metrics.increment('moogly_job_failures_total', kind=job['kind'])
+        await self.bot.db.execute("UPDATE jobs SET status='failed', attempts=attempts+1, last_error=? WHERE id=?", (repr(error), job['id']))
+        settings = await self.bot.settings.get(payload.get('guild_id', 0))
+        if payload.get('failure_message') and settings.get('logs_channel_id'):
+            try:
+                logs_channel = await self.bot.resolver.channel(settings['logs_channel_id'])
+                await logs_channel.send(payload['failure_message'])
+            except discord.HTTPException as e:
+                print(f"Failed to report job {job['id']} failure: {e!r}")
+
+# One line per participant, members who left the server are still listed by id
+async def build_roster(guild, user_ids):
+    members = await bot.resolver.resolve_members(guild, user_ids, concurrency=bot.config.get('roster_concurrency', 4))
+    return [f"{member.mention} ({member.display_name})" if member else f"<@{user_id}>" for user_id, member in zip(user_ids, members)]
+
+# Split lines over as many embeds as needed to stay under the description limit
+def paginate_embeds(title, lines, color, header=''):
+    embeds = []
+    description = header
+    for line in lines:
+        if len(description) + len(line) + 1 > 4096:
+            embeds.append(discord.Embed(title=title, description=description, color=color))
+            description = ''
+        description += ('\n' if description else '') + line
+    embeds.append(discord.Embed(title=title, description=description, color=color))
+    if len(embeds) > 1:
+        for page, embed in enumerate(embeds, start=1):
+            embed.set_footer(text=f"Page {page}/{len(embeds)}")
+    return embeds
+
+# Send embeds in as few messages as the 10 embeds / 6000 characters per message limits allow
+async def send_embeds(channel, embeds, content=None):
+    batch = []
+    size = 0
+    for embed in embeds:
+        if batch and (len(batch) == 10 or size + len(embed) > 6000):
+            await channel.send(content, embeds=batch)
+            content = None
+            batch, size = [], 0
+        batch.append(embed)
+        size += len(embed)
+    await channel.send(content, embeds=batch)
+
+class BotClient(commands.AutoShardedBot):
+    def __init__(self, config, dyes):
         intents = discord.Intents.default()
-        intents.members = True
+        intents.members = config.get('members_intent', True)
         intents.message_content = True
 
+        # Member cache profile: by default every member is chunked and kept. "member_cache"
+        # lists the MemberCacheFlags to enable, [] keeps none and members are loaded on demand.
+        member_cache_flags = discord.MemberCacheFlags.from_intents(intents)
+        if config.get('member_cache') is not None:
+            member_cache_flags = discord.MemberCacheFlags.none()
+            for flag in config['member_cache']:
+                setattr(member_cache_flags, flag, True)
+        self.started_at = time.monotonic()
+        self.time_to_ready = None
+
         dir = os.path.dirname(os.path.realpath(__file__))
         db_path = os.path.join(dir, config['database'])
-        self.db_conn = sqlite3.connect(db_path)
-        self.db_cursor = self.db_conn.cursor()
-        self.db_conn.row_factory = sqlite3.Row
-        self.create_tables()
+        self.metrics = Metrics()
+        self.db = Database(db_path, readers=config.get('database_readers', 4), metrics=self.metrics)
         self.config = config
-
-        self.dyes_fr = dyes_fr
+        # Minutes before a run starts at which reminders are sent, the last one closes the run
+        self.reminder_offsets = sorted(set(config.get('maps_reminder_offsets', [20])), reverse=True)
+        self.scheduler = RunScheduler(self, self.config.get('reminder_max_attempts', 5))
+        self.settings = GuildSettings(self)
+        self.resolver = ResolverCache(self, ttl=config.get('resolver_cache_ttl', 300))
+        self.maps_runs = MapsRunStore(self, write_delay=config.get('maps_run_write_delay', 1.0))
+        self.monitor_task = None
+        self.metrics_runner = None
+        # Deferred interactions still running, cancelled after interaction_timeout seconds
+        self.interaction_tasks = set()
+        self.interaction_timeout = config.get('interaction_timeout', 60)
+        self.embed_updates = EmbedCoalescer(window=config.get('embed_update_window', 1.0))
+        self.jobs = JobQueue(self, {
+            'add_role': self.job_add_role,
+            'remove_role': self.job_remove_role,
+            'edit_nick': self.job_edit_nick,
+            'send_message': self.job_send_message,
+            'send_dm': self.job_send_dm,
+            'admit_member': self.job_admit_member,
+        }, workers=config.get('job_workers', 4), poll_interval=config.get('job_poll_interval', 30))
+
+        self.dyes = dyes
 
         super().__init__(
             command_prefix=commands.when_mentioned_or(config['prefix']),
             intents=intents,
+            member_cache_flags=member_cache_flags,
+            chunk_guilds_at_startup=config.get('chunk_guilds_at_startup', intents.members and member_cache_flags.joined),
+            max_messages=config.get('max_messages', 1000),
+            # Left unset Discord recommends the shard count
+            shard_count=config.get('shard_count'),
             help_command=None,
         )
 
     async def setup_hook(self):
+        await self.instrument()
+        await self.create_tables()
+        await self.jobs.recover()
+        self.jobs.start()
+
         self.add_view(AdmissionMessage(timeout=None))
         print('Registered persistent view: AdmissionMessage')
         self.add_view(ApplicationMessage(timeout=None))
         print('Registered persistent view: ApplicationMessage')
 
-        # Retrieve the message_id, discord_timestamp, and timestamp from the database
-        self.db_cursor.execute('SELECT message_id, discord_timestamp, timestamp, message, available_slots FROM maps_runs')
-        maps_runs = self.db_cursor.fetchall()
+        # One stateless view handles every maps run message, the run is looked up from the clicked message
+        self.add_view(MapsRunView())
+        print('Registered persistent view: MapsRunView')
 
-        # Recreate the MapsRunView instance for each message_id
-        for message_id, discord_timestamp, timestamp, message, available_slots in maps_runs:
-            view = MapsRunView(message_id=int(message_id), timestamp=discord_timestamp, message=message, available_slots=available_slots)
-            self.add_view(view)
-            print(f"Registered persistent view: MapsRunView (message_id={message_id})")
+        await self.maps_runs.load_active()
+        self.maps_runs.start()
+        await self.scheduler.load()
+        self.scheduler.start()
+
+        self.maintenance_task.change_interval(hours=self.config.get('maintenance_interval_hours', 1))
+        self.maintenance_task.start()
 
         return await super().setup_hook()
 
+    async def instrument(self):
+        # Time every REST call by method and route template
+        request = self.http.request
+
+        async def timed_request(route, **kwargs):
+            with self.metrics.timer('moogly_rest_seconds', method=route.method, route=route.path):
+                return await request(route, **kwargs)
+        self.http.request = timed_request
+
+        logging.getLogger('discord.http').addHandler(RateLimitCounter(self.metrics))
+
+        self.metrics.gauge('moogly_db_write_queue_depth', self.db.write_queue.qsize)
+        self.metrics.gauge('moogly_reminders_pending', lambda: len(self.scheduler.heap))
+        self.metrics.gauge('moogly_embed_updates_pending', lambda: len(self.embed_updates.pending))
+        self.metrics.gauge('moogly_job_queue_depth', lambda: self.jobs.depth)
+        self.metrics.gauge('moogly_interactions_running', lambda: len(self.interaction_tasks))
+        self.metrics.gauge('moogly_maps_runs_in_memory', lambda: len(self.maps_runs.runs))
+        self.metrics.gauge('moogly_maps_run_writes_pending', lambda: len(self.maps_runs.joins))
+        self.metrics.gauge('moogly_cached_members', lambda: sum(len(guild.members) for guild in self.guilds))
+        self.metrics.gauge('moogly_resolver_cached_members', lambda: len(self.resolver.members))
+        if resident_memory() is not None:
+            self.metrics.gauge('moogly_resident_memory_bytes', resident_memory)
+        self.monitor_task = asyncio.create_task(self.monitor())
+        if self.config.get('metrics_port'):
+            self.metrics_runner = await self.metrics.serve(self.config.get('metrics_host', '127.0.0.1'), self.config['metrics_port'])
+
+    # Samples event loop lag and the job queue depth
+    async def monitor(self, interval=1.0):
+        ticks = 0
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            lag = time.perf_counter() - started - interval
+            self.metrics.gauge('moogly_event_loop_lag_seconds', lag)
+
+            ticks += 1
+            if ticks % 5 == 0:
+                self.jobs.depth = (await self.db.fetchone("SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running')"))[0]
+            if ticks % 60 == 0:
+                self.resolver.purge()
+
+    # Time every prefix command
+    async def invoke(self, ctx):
+        if ctx.command is None:
+            return await super().invoke(ctx)
+        self.resolver.remember_member(ctx.author)
+        started = time.perf_counter()
+        try:
+            await super().invoke(ctx)
+        finally:
+            self.metrics.observe('moogly_command_seconds', time.perf_counter() - started, command=ctx.command.qualified_name)
+
+    async def on_command_error(self, ctx, error):
+        self.metrics.increment('moogly_errors_total', source='moogly_command_seconds', command=ctx.command.qualified_name if ctx.command else '')
+        return await super().on_command_error(ctx, error)
+
     async def on_ready(self):
-        self.ping_task.start()
+        await self.settings.claim_legacy()
+        # Resolve configured channels once, they are then served from memory
+        channel_ids = []
+        for guild in self.guilds:
+            settings = await self.settings.get(guild.id)
+            channel_ids += [settings[key] for key in ('events_channel_id', 'logs_channel_id', 'admission_channel_id') if settings.get(key)]
+        await self.resolver.pin_channels(channel_ids)
         print(f"Logged in as {self.user} (ID: {self.user.id})")
+
+        # Startup cost of the configured cache profile, on_ready fires again after reconnects
+        if self.time_to_ready is None:
+            self.time_to_ready = time.monotonic() - self.started_at
+            self.metrics.gauge('moogly_time_to_ready_seconds', self.time_to_ready)
+            rss = resident_memory()
+            memory = f"{rss / 1024 / 1024:.1f} MB resident" if rss is not None else 'resident memory unknown'
+            members = sum(len(guild.members) for guild in self.guilds)
+            print(f"Ready in {self.time_to_ready:.1f}s: {len(self.guilds)} guilds, {members} cached members, {memory}")
         print('------')
 
-    def create_tables(self):
-        self.db_cursor.execute('''
+    async def on_member_update(self, before, after):
+        self.resolver.invalidate_member(after.guild.id, after.id)
+
+    async def on_member_remove(self, member):
+        self.resolver.invalidate_member(member.guild.id, member.id)
+
+    async def on_guild_channel_update(self, before, after):
+        self.resolver.invalidate_channel(after.id, after)
+
+    async def on_guild_channel_delete(self, channel):
+        self.resolver.invalidate_channel(channel.id)
+
+    def interaction_age(self, interaction):
+        return (discord.utils.utcnow() - interaction.created_at).total_seconds()
+
+    def run_interaction(self, interaction, coro, name):
+        task = asyncio.create_task(self.complete_interaction(interaction, coro, name))
+        self.interaction_tasks.add(task)
+        task.add_done_callback(self.interaction_tasks.discard)
+
+    # Run the rest of a deferred interaction and send its result as a followup
+    async def complete_interaction(self, interaction, coro, name):
+        try:
+            with self.metrics.timer('moogly_interaction_background_seconds', handler=name):
+                result = await asyncio.wait_for(coro, timeout=self.interaction_timeout)
+        except asyncio.TimeoutError:
+            self.report_deadline_miss(interaction.guild_id, name, f"did not complete within {self.interaction_timeout}s and was cancelled")
+            result = 'Error: this took too long and was cancelled, please try again'
+        except Exception as e:
+            traceback.print_exception(type(e), e, e.__traceback__)
+            result = 'Oops! Something went wrong. Please try again'
+
+        if result:
+            try:
+                await interaction.followup.send(result, ephemeral=True)
+            except discord.HTTPException as e:
+                print(f"Failed to send followup for {name}: {e}")
+
+    def report_deadline_miss(self, guild_id, name, reason):
+        self.metrics.increment('moogly_interaction_deadline_misses_total', handler=name)
+        print(f"Interaction deadline missed: {name} {reason}")
+        task = asyncio.create_task(self.log_to_guild(guild_id, f"Interaction deadline missed: `{name}` {reason}"))
+        self.interaction_tasks.add(task)
+        task.add_done_callback(self.interaction_tasks.discard)
+
+    # Going through the job queue keeps the log message off the caller's path
+    async def log_to_guild(self, guild_id, content):
+        settings = await self.settings.get(guild_id or 0)
+        if settings.get('logs_channel_id'):
+            await self.jobs.enqueue([('send_message', {'channel_id': settings['logs_channel_id'], 'content': content}, None)])
+
+    async def close(self):
+        self.maintenance_task.cancel()
+        # setup_hook never ran if the login failed
+        if self.monitor_task is not None:
+            self.monitor_task.cancel()
+        # Running interactions get a moment to finish, cancelled database writes are skipped or complete safely
+        if self.interaction_tasks:
+            await asyncio.wait(self.interaction_tasks, timeout=self.config.get('shutdown_grace', 5))
+        for task in self.interaction_tasks:
+            task.cancel()
+        await asyncio.gather(*self.interaction_tasks, return_exceptions=True)
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        self.scheduler.stop()
+        self.jobs.stop()
+        await self.maps_runs.stop()
+        await self.embed_updates.flush()
+        await self.maps_runs.flush()
+        await super().close()
+        # Let the writer thread drain its queue before exiting
+        await asyncio.to_thread(self.db.close)
+
+    async def create_tables(self):
+        await self.db.write(self._create_tables)
+
+    def _create_tables(self, conn):
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS guild_settings (
+            guild_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            value INTEGER,
+            PRIMARY KEY (guild_id, key)
+        )
+        ''')
+        conn.execute('''
         CREATE TABLE IF NOT EXISTS applications (
-            user_id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL DEFAULT 0,
+            user_id INTEGER NOT NULL,
             fc TEXT,
-            ingame_name TEXT
+            ingame_name TEXT,
+            message_id INTEGER,
+            PRIMARY KEY (guild_id, user_id)
         )
         ''')
-        self.db_cursor.execute('''
+
+        # Applications now keep the id of their admission message. Only pending applications
+        # live here, resolved ones move to applications_archive along with their status.
+        columns = [column['name'] for column in conn.execute('PRAGMA table_info(applications)')]
+        if 'message_id' not in columns:
+            conn.execute('ALTER TABLE applications ADD COLUMN message_id INTEGER')
+            print('Added message_id to applications')
+
+        # Applications became per guild, the primary key changes so the table is rebuilt.
+        # Rows without a known guild get guild_id 0 until GuildSettings.claim_legacy runs.
+        legacy_guild_id = self.config.get('guild_id', 0)
+        if 'guild_id' not in [column['name'] for column in conn.execute('PRAGMA table_info(applications)')]:
+            conn.execute('ALTER TABLE applications RENAME TO applications_old')
+            conn.execute('''
+            CREATE TABLE applications (
+                guild_id INTEGER NOT NULL DEFAULT 0,
+                user_id INTEGER NOT NULL,
+                fc TEXT,
+                ingame_name TEXT,
+                message_id INTEGER,
+                PRIMARY KEY (guild_id, user_id)
+            )
+            ''')
+            conn.execute(
+                'INSERT INTO applications (guild_id, user_id, fc, ingame_name, message_id) SELECT ?, user_id, fc, ingame_name, message_id FROM applications_old',
+                (legacy_guild_id,)
+            )
+            conn.execute('DROP TABLE applications_old')
+            print('Added guild_id to applications')
+        conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS applications_message_id ON applications (message_id)')
+        conn.execute('DROP INDEX IF EXISTS applications_status')
+        conn.execute('DROP INDEX IF EXISTS applications_guild_status')
+        if 'status' in [column['name'] for column in conn.execute('PRAGMA table_info(applications)')]:
+            conn.execute('ALTER TABLE applications DROP COLUMN status')
+            print('Dropped status from applications')
+        conn.execute('CREATE INDEX IF NOT EXISTS applications_guild_fc ON applications (guild_id, fc)')
+        conn.execute('''
         CREATE TABLE IF NOT EXISTS maps_runs (
             message_id INTEGER PRIMARY KEY,
             discord_timestamp TEXT,
             timestamp TIMESTAMP,
             message TEXT,
             available_slots INTEGER DEFAULT 8,
-            user_ids TEXT,
-            pinged INTEGER DEFAULT 0
+            pinged INTEGER DEFAULT 0,
+            guild_id INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS maps_run_participants (
+            message_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            joined_at TIMESTAMP,
+            PRIMARY KEY (message_id, user_id)
         )
         ''')
-        self.db_conn.commit()
-
-    @tasks.loop(seconds=60)
-    async def ping_task(self):
-        # Fetch maps runs that have not been pinged yet
-        self.db_cursor.execute('SELECT * FROM maps_runs WHERE pinged=0')
-        maps_runs = self.db_cursor.fetchall()
-
-        if not maps_runs:
-            return
-
-        current_time = datetime.now(timezone.utc)
-
-        for maps_run in maps_runs:
-            # Calculate time difference between current time and ping time
-            current_time = datetime.now(timezone.utc)
-            ping_time = datetime.fromtimestamp(maps_run[2], tz=timezone.utc) - timedelta(minutes=20)
-
-            if current_time >= ping_time:
-                # Fetch the joined users
-                joined_user_ids = maps_run[5].split(',')
-                joined_users = [f"<@{user_id}>" for user_id in joined_user_ids if user_id]
 
-                # Create an embed with the ping message
-                embed = discord.Embed(
-                    title="Treasure Maps run reminder 🚨",
-                    description=f"The maps run will start in 20 minutes. Are you ready?\n\nJoined Users:\n" + "\n".join(joined_users),
-                    color=0xff8a08
+        # Migrate the old comma-joined user_ids column into maps_run_participants
+        columns = [column['name'] for column in conn.execute('PRAGMA table_info(maps_runs)')]
+        if 'user_ids' in columns:
+            for message_id, user_ids in conn.execute('SELECT message_id, user_ids FROM maps_runs').fetchall():
+                conn.executemany(
+                    'INSERT OR IGNORE INTO maps_run_participants (message_id, user_id, joined_at) VALUES (?, ?, NULL)',
+                    [(message_id, int(user_id)) for user_id in (user_ids or '').split(',') if user_id]
                 )
+            conn.execute('ALTER TABLE maps_runs DROP COLUMN user_ids')
+            print('Migrated maps_runs.user_ids to maps_run_participants')
+        if 'guild_id' not in columns:
+            conn.execute('ALTER TABLE maps_runs ADD COLUMN guild_id INTEGER NOT NULL DEFAULT 0')
+            conn.execute('UPDATE maps_runs SET guild_id=?', (self.config.get('guild_id', 0),))
+            print('Added guild_id to maps_runs')
+
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS maps_run_reminders (
+            message_id INTEGER NOT NULL,
+            minutes_before INTEGER NOT NULL,
+            timestamp TIMESTAMP NOT NULL,
+            pinged INTEGER DEFAULT 0,
+            PRIMARY KEY (message_id, minutes_before)
+        )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS maps_run_reminders_due ON maps_run_reminders (pinged, timestamp)')
+
+        # Runs that were never pinged get a reminder for every configured offset
+        for minutes_before in self.reminder_offsets:
+            conn.execute(
+                'INSERT OR IGNORE INTO maps_run_reminders (message_id, minutes_before, timestamp, pinged) SELECT message_id, ?, timestamp - ?, 0 FROM maps_runs WHERE pinged=0',
+                (minutes_before, minutes_before * 60)
+            )
+
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            dedup_key TEXT UNIQUE,
+            attempts INTEGER DEFAULT 0,
+            run_at TIMESTAMP NOT NULL,
+            status TEXT DEFAULT 'pending',
+            last_error TEXT
+        )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, run_at)')
 
-                # Find the message to ping
-                message_id = maps_run[0]
-                channel_id = self.config['events_channel_id']
-                channel = await self.fetch_channel(channel_id)
-                if channel:
-                    try:
-                        await channel.send(f"<@&{self.config['maps_notifications_role_id']}> ", embed=embed)
-
-                        # Update the pinged status to true
-                        self.db_cursor.execute('UPDATE maps_runs SET pinged=1 WHERE message_id=?', (message_id,))
-                        self.db_conn.commit()
-
-                    except Exception as e:
-                        print(e)
-
-# Load config from config.json file
+        # Finished runs and resolved applications are moved here by maintenance_task
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS maps_runs_archive (
+            message_id INTEGER PRIMARY KEY,
+            discord_timestamp TEXT,
+            timestamp TIMESTAMP,
+            message TEXT,
+            available_slots INTEGER,
+            archived_at TIMESTAMP NOT NULL,
+            guild_id INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        if 'guild_id' not in [column['name'] for column in conn.execute('PRAGMA table_info(maps_runs_archive)')]:
+            conn.execute('ALTER TABLE maps_runs_archive ADD COLUMN guild_id INTEGER NOT NULL DEFAULT 0')
+            conn.execute('UPDATE maps_runs_archive SET guild_id=?', (legacy_guild_id,))
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS maps_run_participants_archive (
+            message_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            joined_at TIMESTAMP,
+            PRIMARY KEY (message_id, user_id)
+        )
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS applications_archive (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            fc TEXT,
+            ingame_name TEXT,
+            status TEXT NOT NULL,
+            resolved_at TIMESTAMP NOT NULL,
+            message_id INTEGER,
+            guild_id INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        columns = [column['name'] for column in conn.execute('PRAGMA table_info(applications_archive)')]
+        if 'message_id' not in columns:
+            conn.execute('ALTER TABLE applications_archive ADD COLUMN message_id INTEGER')
+        if 'guild_id' not in columns:
+            conn.execute('ALTER TABLE applications_archive ADD COLUMN guild_id INTEGER NOT NULL DEFAULT 0')
+            conn.execute('UPDATE applications_archive SET guild_id=?', (legacy_guild_id,))
+        conn.execute('CREATE INDEX IF NOT EXISTS maps_runs_timestamp ON maps_runs (timestamp)')
+        conn.execute('CREATE INDEX IF NOT EXISTS maps_runs_archive_archived_at ON maps_runs_archive (archived_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS applications_archive_resolved_at ON applications_archive (resolved_at)')
+
+    # Hourly by default: archive finished runs, export and drop archives past the
+    # retention window, then reclaim free pages and refresh the query planner stats
+    @tasks.loop(hours=1)
+    async def maintenance_task(self):
+        started = time.perf_counter()
+        try:
+            archived = await self.archive_maps_runs()
+            exported = await self.export_archives()
+            await self.compact()
+        except Exception as e:
+            # Keep the loop alive, the next run will pick up where this one failed
+            traceback.print_exception(type(e), e, e.__traceback__)
+            return
+        self.metrics.observe('moogly_maintenance_seconds', time.perf_counter() - started)
+        if archived or exported:
+            print(f"Maintenance: archived {archived} maps runs, exported {exported} archived rows")
+
+    # Runs that started more than maps_run_grace_hours ago, moved in batches so the writer is never held for long
+    async def archive_maps_runs(self, batch_size=500):
+        cutoff = time.time() - self.config.get('maps_run_grace_hours', 12) * 3600
+        archived = 0
+        # Joins still in memory must reach the database before their run is moved, and no
+        # flush may land between archiving a run and dropping it from memory
+        async with self.maps_runs.lock:
+            if not await self.maps_runs.flush_locked():
+                return 0
+            while True:
+                message_ids = await self.db.write(lambda conn: self._archive_maps_runs(conn, cutoff, batch_size))
+                for message_id in message_ids:
+                    self.maps_runs.discard(message_id)
+                archived += len(message_ids)
+                if len(message_ids) < batch_size:
+                    return archived
+
+    @staticmethod
+    def _archive_maps_runs(conn, cutoff, batch_size):
+        message_ids = [row[0] for row in conn.execute('SELECT message_id FROM maps_runs WHERE timestamp < ? LIMIT ?', (cutoff, batch_size))]
+        if not message_ids:
+            return []
+        placeholders = ','.join('?' * len(message_ids))
+        conn.execute(
+            f'INSERT OR REPLACE INTO maps_runs_archive (message_id, discord_timestamp, timestamp, message, available_slots, archived_at, guild_id) SELECT message_id, discord_timestamp, timestamp, message, available_slots, ?, guild_id FROM maps_runs WHERE message_id IN ({placeholders})',
+            (time.time(), *message_ids)
+        )
+        conn.execute(
+            f'INSERT OR IGNORE INTO maps_run_participants_archive (message_id, user_id, joined_at) SELECT message_id, user_id, joined_at FROM maps_run_participants WHERE message_id IN ({placeholders})',
+            message_ids
+        )
+        for table in ('maps_run_participants', 'maps_run_reminders', 'maps_runs'):
+            conn.execute(f'DELETE FROM {table} WHERE message_id IN ({placeholders})', message_ids)
+        return message_ids
+
+    # Archived rows older than retention_days are written to a gzipped JSON lines file and deleted
+    async def export_archives(self):
+        cutoff = time.time() - self.config.get('retention_days', 180) * 86400
+        rows = await self.db.read(lambda conn: self._archived_rows(conn, cutoff))
+        if not rows:
+            await self.db.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND run_at < ?", (cutoff,))
+            return 0
+
+        archive_dir = os.path.join(os.path.dirname(self.db.path), self.config.get('archive_dir', 'archive'))
+        archive_path = os.path.join(archive_dir, f"moogly-archive-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}.jsonl.gz")
+        await asyncio.to_thread(self._write_archive, archive_path, rows)
+        await self.db.write(lambda conn: self._delete_archived(conn, cutoff))
+        return len(rows)
+
+    @staticmethod
+    def _archived_rows(conn, cutoff):
+        rows = []
+        for maps_run in conn.execute('SELECT * FROM maps_runs_archive WHERE archived_at < ?', (cutoff,)):
+            maps_run = dict(maps_run)
+            maps_run['participants'] = [dict(row) for row in conn.execute('SELECT user_id, joined_at FROM maps_run_participants_archive WHERE message_id=?', (maps_run['message_id'],))]
+            rows.append({'type': 'maps_run', **maps_run})
+        for application in conn.execute('SELECT * FROM applications_archive WHERE resolved_at < ?', (cutoff,)):
+            rows.append({'type': 'application', **dict(application)})
+        return rows
+
+    @staticmethod
+    def _write_archive(archive_path, rows):
+        os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+        with gzip.open(archive_path, 'wt', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row) + '\n')
+
+    @staticmethod
+    def _delete_archived(conn, cutoff):
+        conn.execute('DELETE FROM maps_run_participants_archive WHERE message_id IN (SELECT message_id FROM maps_runs_archive WHERE archived_at < ?)', (cutoff,))
+        conn.execute('DELETE FROM maps_runs_archive WHERE archived_at < ?', (cutoff,))
+        conn.execute('DELETE FROM applications_archive WHERE resolved_at < ?', (cutoff,))
+        conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND run_at < ?", (cutoff,))
+
+    # Give free pages back a chunk at a time, then let SQLite analyze what changed
+    async def compact(self, pages=1000):
+        free_pages = (await self.db.fetchone('PRAGMA freelist_count'))[0]
+        while free_pages > 0:
+            # incremental_vacuum frees one page per step, fetchall runs it to completion
+            await self.db.write(lambda conn: conn.execute(f'PRAGMA incremental_vacuum({pages})').fetchall())
+            remaining = (await self.db.fetchone('PRAGMA freelist_count'))[0]
+            if remaining >= free_pages:
+                break
+            free_pages = remaining
+        await self.db.write(lambda conn: conn.execute('PRAGMA analysis_limit=1000').fetchall() + conn.execute('PRAGMA optimize').fetchall())
+
+    # Job handlers, a member who left the server in the meantime is skipped
+    async def job_add_role(self, payload):
+        member = await self.resolver.member(self.get_guild(payload['guild_id']), payload['user_id'])
+        if member:
+            await member.add_roles(discord.Object(payload['role_id']))
+
+    async def job_remove_role(self, payload):
+        member = await self.resolver.member(self.get_guild(payload['guild_id']), payload['user_id'])
+        if member:
+            await member.remove_roles(discord.Object(payload['role_id']))
+
+    async def job_edit_nick(self, payload):
+        member = await self.resolver.member(self.get_guild(payload['guild_id']), payload['user_id'])
+        if member:
+            await member.edit(nick=payload['nick'])
+
+    # Swap the newcomer role for the FC role and set the nickname. Roles are changed one
+    # by one so a possibly stale cached member never overwrites the rest of its roles.
+    async def job_admit_member(self, payload):
+        member = await self.resolver.member(self.get_guild(payload['guild_id']), payload['user_id'])
+        if member:
+            await member.remove_roles(discord.Object(payload['remove_role_id']))
+            await member.add_roles(discord.Object(payload['add_role_id']))
+            await member.edit(nick=payload['nick'])
+
+    async def job_send_message(self, payload):
+        channel = await self.resolver.channel(payload['channel_id'])
+        await channel.send(payload['content'])
+
+    async def job_send_dm(self, payload):
+        user = await self.resolver.user(payload['user_id'])
+        if user:
+            await user.send(payload['content'])
+
+    # Insert the reminders of a new maps run and hand them to the scheduler
+    async def schedule_reminders(self, message_id, timestamp):
+        now = time.time()
+        # Offsets already in the past are skipped, except the last one which always fires and closes the run
+        reminders = [
+            (message_id, minutes_before, timestamp - minutes_before * 60)
+            for minutes_before in self.reminder_offsets
+            if timestamp - minutes_before * 60 > now or minutes_before == self.reminder_offsets[-1]
+        ]
+        await self.db.executemany('INSERT OR IGNORE INTO maps_run_reminders (message_id, minutes_before, timestamp, pinged) VALUES (?, ?, ?, 0)', reminders)
+        for message_id, minutes_before, due in reminders:
+            self.scheduler.schedule(due, message_id, minutes_before)
+
+    def reminder_offsets_text(self):
+        offsets = [str(minutes_before) for minutes_before in self.reminder_offsets]
+        return offsets[0] if len(offsets) == 1 else f"{', '.join(offsets[:-1])} and {offsets[-1]}"
+
+    async def send_reminder(self, message_id, minutes_before):
+        maps_run = await self.maps_runs.get(message_id)
+
+        # Runs that were deleted or already started while the bot was offline are not pinged anymore
+        if maps_run and maps_run.starts_at > time.time():
+            # A late reminder says how long is actually left
+            minutes_left = min(minutes_before, math.ceil((maps_run.starts_at - time.time()) / 60))
+            settings = await self.settings.get(maps_run.guild_id)
+            channel = await self.resolver.channel(settings['events_channel_id'])
+            joined_users = await build_roster(channel.guild, list(maps_run.participants))
+
+            # Create the embeds with the ping message
+            embeds = paginate_embeds(
+                "Treasure Maps run reminder 🚨",
+                joined_users,
+                0xff8a08,
+                header=f"The maps run will start in {minutes_left} minutes. Are you ready?\n\nJoined Users:"
+            )
+            await send_embeds(channel, embeds, content=f"<@&{settings['maps_notifications_role_id']}> ")
+
+        await self.mark_reminder_sent(message_id, minutes_before)
+
+    async def mark_reminder_sent(self, message_id, minutes_before):
+        closed = await self.db.write(lambda conn: self._mark_reminder_sent(conn, message_id, minutes_before))
+        maps_run = self.maps_runs.runs.get(message_id)
+        if closed and maps_run:
+            maps_run.pinged = 1
+
+    @staticmethod
+    def _mark_reminder_sent(conn, message_id, minutes_before):
+        conn.execute('UPDATE maps_run_reminders SET pinged=1 WHERE message_id=? AND minutes_before=?', (message_id, minutes_before))
+        # Once the last reminder went out the run is closed to new joins
+        return conn.execute(
+            'UPDATE maps_runs SET pinged=1 WHERE message_id=? AND NOT EXISTS (SELECT 1 FROM maps_run_reminders WHERE message_id=? AND pinged=0)',
+            (message_id, message_id)
+        ).rowcount > 0
+
+# Load config from config.json file, MOOGLY_CONFIG can point to another file
 def load_config():
     dir = os.path.dirname(os.path.realpath(__file__))
-    config_path = os.path.join(dir, '/config/config.json')
+    config_path = os.path.join(dir, os.environ.get('MOOGLY_CONFIG', '/config/config.json'))
     with open(config_path, 'r') as f:
         return json.load(f)
 
-def load_dyes_fr():
+# Load every dyes_<lang>.json file next to the bot
+def load_dyes():
     dir = os.path.dirname(os.path.realpath(__file__))
-    config_path = os.path.join(dir, 'dyes_fr.json')
-    with open(config_path, 'r') as f:
-        return json.load(f)
-
-bot = BotClient(load_config(), load_dyes_fr())
+    dyes = {}
+    for dyes_path in sorted(glob.glob(os.path.join(dir, 'dyes_*.json'))):
+        lang = os.path.basename(dyes_path)[len('dyes_'):-len('.json')]
+        with open(dyes_path, 'r') as f:
+            dyes[lang] = DyeIndex(lang, json.load(f))
+    return dyes
+
+bot = BotClient(load_config(), load_dyes())
+
+# Guild administrators holding the guild's administrator role, while no role is set
+# the administrator permission alone is enough so the guild can be configured
+async def is_guild_admin(member):
+    if not member.guild_permissions.administrator:
+        return False
+    role_id = (await bot.settings.get(member.guild.id)).get('administrator_role_id')
+    return role_id is None or role_id in [role.id for role in member.roles]
+
+# Command check resolved against the invoking guild's settings
+def guild_admin():
+    async def predicate(ctx):
+        if ctx.guild is None:
+            raise commands.NoPrivateMessage()
+        if not ctx.channel.permissions_for(ctx.author).administrator:
+            raise commands.MissingPermissions(['administrator'])
+        role_id = (await bot.settings.get(ctx.guild.id)).get('administrator_role_id')
+        if role_id is not None and role_id not in [role.id for role in ctx.author.roles]:
+            raise commands.MissingRole(role_id)
+        return True
+    return commands.check(predicate)
 
 # UI Name modal
 class ApplicationModal(discord.ui.Modal, title='Access application'):
@@ -141,113 +1628,161 @@ class ApplicationModal(discord.ui.Modal, title='Access application'):
         placeholder='Name LastName',
     )
 
+    @instrumented
+    @deferred
     async def on_submit(self, interaction: discord.Interaction):
         if not self.name.value or len(self.name.value.split(' ')) != 2:
-            await interaction.response.send_message('Error: Invalid in-game name (format: Name LastName)', ephemeral=True)
-            return
+            return 'Error: Invalid in-game name (format: Name LastName)'
 
-        bot.db_cursor.execute('INSERT INTO applications (user_id, fc, ingame_name) VALUES (?, ?, ?)', (interaction.user.id, self.fc, self.name.value))
-        bot.db_conn.commit()
+        await bot.db.execute('INSERT INTO applications (guild_id, user_id, fc, ingame_name) VALUES (?, ?, ?, ?)', (interaction.guild_id, interaction.user.id, self.fc, self.name.value))
 
-        application_channel = await bot.fetch_channel(bot.config['admission_channel_id'])
+        settings = await bot.settings.get(interaction.guild_id)
+        application_channel = await bot.resolver.channel(settings['admission_channel_id'])
         message_content = f"New application from {interaction.user.mention} (ID: {interaction.user.id}):\nIn-game name: {self.name.value}\nFC: {self.fc}"
-        await application_channel.send(message_content, view=AdmissionMessage())
-        await interaction.response.send_message(f"Application sent, awaiting approval...", ephemeral=True)
+        message = await application_channel.send(message_content, view=AdmissionMessage())
+        # Approve/Decline find the application from the clicked message
+        await bot.db.execute('UPDATE applications SET message_id=? WHERE guild_id=? AND user_id=?', (message.id, interaction.guild_id, interaction.user.id))
+        return 'Application sent, awaiting approval...'
 
     async def on_error(self, interaction: discord.Interaction, error: Exception):
-        await interaction.response.send_message('Oops! Something went wrong. Please try again', ephemeral=True)
+        if not interaction.response.is_done():
+            await interaction.response.send_message('Oops! Something went wrong. Please try again', ephemeral=True)
         traceback.print_exception(type(error), error, error.__traceback__) # Make sure we know what the error actually is
 
+# Delete an application and queue its side effects, returns False if someone else already processed it
+def resolve_application(conn, guild_id, user_id, status, jobs):
+    conn.execute(
+        'INSERT INTO applications_archive (guild_id, user_id, fc, ingame_name, status, resolved_at, message_id) SELECT guild_id, user_id, fc, ingame_name, ?, ?, message_id FROM applications WHERE guild_id=? AND user_id=?',
+        (status, time.time(), guild_id, user_id)
+    )
+    if not conn.execute('DELETE FROM applications WHERE guild_id=? AND user_id=?', (guild_id, user_id)).rowcount:
+        return False
+    JobQueue.add(conn, jobs)
+    return True
+
+# Resolve many applications in one transaction, returns the user_ids that were still pending
+def resolve_applications(conn, guild_id, status, jobs_by_user):
+    return [user_id for user_id, jobs in jobs_by_user.items() if resolve_application(conn, guild_id, user_id, status, jobs)]
+
+FC_ROLES = {'Seventh Haven': 'seventh_haven_role_id', 'FC Friend': 'fc_friend_role_id'}
+
+# Jobs applying an approval: one admit_member job swapping the roles and setting the nickname
+# (three requests, so a stale cached member never overwrites other roles), then the DM.
+# Bulk approvals leave the log out and post one summary instead.
+def approval_jobs(settings, application, dedup_prefix, log=True):
+    user_id = application['user_id']
+    failure_message = f"Execution of application for <@{user_id}> failed, are you sure the user doesn\'t have a role above Moogly\'s role?"
+    jobs = [
+        ('admit_member', {
+            'guild_id': application['guild_id'],
+            'user_id': user_id,
+            'remove_role_id': settings['newcomer_role_id'],
+            'add_role_id': settings[FC_ROLES[application['fc']]],
+            'nick': application['ingame_name'],
+            'failure_message': failure_message,
+        }, f"{dedup_prefix}:admit"),
+        ('send_dm', {'user_id': user_id, 'content': 'Your application to get access to Seventh Haven server has been approved, you now have access to the server.'}, f"{dedup_prefix}:dm"),
+    ]
+    if log and settings.get('logs_channel_id'):
+        jobs.append(('send_message', {'channel_id': settings['logs_channel_id'], 'content': f"Application from <@{user_id}> (ID: {user_id}) approved:\nIn-game name: {application['ingame_name']}\nFC: {application['fc']}"}, f"{dedup_prefix}:log"))
+    return jobs
+
+def decline_jobs(settings, application, dedup_prefix, log=True):
+    user_id = application['user_id']
+    jobs = [
+        ('send_dm', {'user_id': user_id, 'content': 'Your application to get access to Seventh Haven server has been declined, please try again.'}, f"{dedup_prefix}:dm"),
+    ]
+    if log and settings.get('logs_channel_id'):
+        jobs.append(('send_message', {'channel_id': settings['logs_channel_id'], 'content': f"Application from <@{user_id}> (ID: {user_id}) declined:\nIn-game name: {application['ingame_name']}\nFC: {application['fc']}"}, f"{dedup_prefix}:log"))
+    return jobs
+
 # Approve/Deny view
 class AdmissionMessage(discord.ui.View):
     async def interaction_check(self, interaction: discord.Interaction[discord.Client]) -> bool:
-        member = await interaction.guild.fetch_member(interaction.user.id)
-        if member.guild_permissions.administrator and bot.config['administrator_role_id'] in [role.id for role in member.roles]:
+        member = await bot.resolver.interaction_member(interaction)
+        if await is_guild_admin(member):
             return True
         else:
             await interaction.response.send_message("You don't have permission to use this button.", ephemeral=True)
             return False
 
+    # Only used for admission messages posted before applications stored their message_id
     def extract_user_id(self, message_content: str) -> int:
         start_index = message_content.find('(ID: ') + len('(ID: ')
         end_index = message_content.find(')', start_index)
         user_id_str = message_content[start_index:end_index]
         return int(user_id_str)
 
+    async def find_application(self, guild_id, message):
+        application = await bot.db.fetchone("SELECT * FROM applications WHERE message_id=?", (message.id,))
+        if application is None and '(ID: ' in message.content:
+            user_id = self.extract_user_id(message.content)
+            if await bot.db.execute('UPDATE applications SET message_id=? WHERE guild_id=? AND user_id=? AND message_id IS NULL', (message.id, guild_id, user_id)):
+                application = await bot.db.fetchone('SELECT * FROM applications WHERE message_id=?', (message.id,))
+        return application
+
     @discord.ui.button(label='Approve', style=discord.ButtonStyle.green, custom_id='AdmissionMessage:approve_button')
+    @instrumented
+    @deferred
     async def approve_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        user_id = self.extract_user_id(interaction.message.content)
-        bot.db_cursor.execute('SELECT * FROM applications WHERE user_id=?', (user_id,))
-        application = bot.db_cursor.fetchone()
+        application = await self.find_application(interaction.guild_id, interaction.message)
 
         if not application:
-            await interaction.response.send_message('Error: user_id not found in applications database', ephemeral=True)
-            return
+            return 'Error: no pending application for this message'
+        user_id = application['user_id']
 
-        user = await interaction.guild.fetch_member(user_id)
+        user = await bot.resolver.member(interaction.guild, user_id)
 
         if user:
-            if application[1] == 'Seventh Haven':
-                role = interaction.guild.get_role(bot.config['seventh_haven_role_id'])
-            elif application[1] == 'FC Friend':
-                role = interaction.guild.get_role(bot.config['fc_friend_role_id'])
-            newcomer_role = interaction.guild.get_role(bot.config['newcomer_role_id'])
-
-            bot.db_cursor.execute('DELETE FROM applications WHERE user_id=?', (user_id,))
-            bot.db_conn.commit()
-            logs_channel = await bot.fetch_channel(bot.config['logs_channel_id'])
+            # Side effects are queued in the same transaction that resolves the application
+            jobs = approval_jobs(await bot.settings.get(interaction.guild_id), application, f"application:{interaction.message.id}")
+            if not await bot.db.write(lambda conn: resolve_application(conn, interaction.guild_id, user_id, 'approved', jobs)):
+                return 'Error: this application was already processed'
+            bot.jobs.notify()
 
-            try:
-                await user.remove_roles(newcomer_role)
-                await user.add_roles(role)
-                await user.edit(nick=application[2])
-            except discord.errors.Forbidden:
-                await logs_channel.send(f"Execution of application for {user.mention} failed, are you sure the user doesn\'t have a role above Moogly\'s role?")
             await interaction.message.delete()
-            await interaction.response.send_message(f"Application for {user.mention} approved", ephemeral=True)
-            await logs_channel.send(f"Application from {user.mention} (ID: {user_id}) approved:\nIn-game name: {application[2]}\nFC: {application[1]}")
-            await user.send('Your application to get access to Seventh Haven server has been approved, you now have access to the server.')
+            return f"Application for {user.mention} approved"
         else:
-            await interaction.response.send_message('Error: Failed to fetch user', ephemeral=True)
+            return 'Error: Failed to fetch user'
 
     @discord.ui.button(label='Decline', style=discord.ButtonStyle.red, custom_id='AdmissionMessage:decline_button')
+    @instrumented
+    @deferred
     async def decline_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        user_id = self.extract_user_id(interaction.message.content)
-        bot.db_cursor.execute('SELECT * FROM applications WHERE user_id=?', (user_id,))
-        application = bot.db_cursor.fetchone()
+        application = await self.find_application(interaction.guild_id, interaction.message)
 
         if not application:
-            await interaction.response.send_message('Error: user_id not found in applications database', ephemeral=True)
-            return
+            return 'Error: no pending application for this message'
+        user_id = application['user_id']
 
-        user = await bot.fetch_user(user_id)
+        user = await bot.resolver.user(user_id)
 
         if user:
-            bot.db_cursor.execute('DELETE FROM applications WHERE user_id=?', (user_id,))
-            bot.db_conn.commit()
+            jobs = decline_jobs(await bot.settings.get(interaction.guild_id), application, f"application:{interaction.message.id}")
+            if not await bot.db.write(lambda conn: resolve_application(conn, interaction.guild_id, user_id, 'declined', jobs)):
+                return 'Error: this application was already processed'
+            bot.jobs.notify()
 
-            await interaction.response.send_message(f"Application for {user.mention} declined", ephemeral=True)
-            logs_channel = await bot.fetch_channel(bot.config['logs_channel_id'])
-            await logs_channel.send(f"Application from {user.mention} (ID: {user_id}) declined:\nIn-game name: {application[2]}\nFC: {application[1]}")
-            await user.send('Your application to get access to Seventh Haven server has been declined, please try again.')
             await interaction.message.delete()
+            return f"Application for {user.mention} declined"
         else:
-            await interaction.response.send_message('Error: Failed to fetch user', ephemeral=True)
+            return 'Error: Failed to fetch user'
 
 # Send application view
 class ApplicationMessage(discord.ui.View):
     async def interaction_check(self, interaction: discord.Interaction[discord.Client]) -> bool:
-        member = await interaction.guild.fetch_member(interaction.user.id)
-        if bot.config['newcomer_role_id'] in [role.id for role in member.roles]:
+        member = await bot.resolver.interaction_member(interaction)
+        settings = await bot.settings.get(interaction.guild_id)
+        if settings.get('newcomer_role_id') in [role.id for role in member.roles]:
             return True
         else:
             await interaction.response.send_message("You don't have permission to use this button. Please contact an administrator.", ephemeral=True)
             return False
 
     @discord.ui.button(label='Seventh Haven', style=discord.ButtonStyle.blurple, custom_id='ApplicationMessage:seventh_haven_button', emoji=discord.PartialEmoji.from_str('<:seventhhaven:1281356115954761758>'))
+    @instrumented
     async def seventh_haven_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        bot.db_cursor.execute('SELECT * FROM applications WHERE user_id=?', (interaction.user.id,))
-        application = bot.db_cursor.fetchone()
+        application = await bot.db.fetchone('SELECT * FROM applications WHERE guild_id=? AND user_id=?', (interaction.guild_id, interaction.user.id))
 
         if not application:
             await interaction.response.send_modal(ApplicationModal('Seventh Haven'))
@@ -255,9 +1790,9 @@ class ApplicationMessage(discord.ui.View):
             await interaction.response.send_message('You already sent an application, please wait until an administrator reviews it.', ephemeral=True)
 
     @discord.ui.button(label='FC Friend', style=discord.ButtonStyle.green, custom_id='ApplicationMessage:fc_friend_button', emoji=discord.PartialEmoji.from_str('👋'))
+    @instrumented
     async def fc_friend_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        bot.db_cursor.execute('SELECT * FROM applications WHERE user_id=?', (interaction.user.id,))
-        application = bot.db_cursor.fetchone()
+        application = await bot.db.fetchone('SELECT * FROM applications WHERE guild_id=? AND user_id=?', (interaction.guild_id, interaction.user.id))
 
         if not application:
             await interaction.response.send_modal(ApplicationModal('FC Friend'))
@@ -266,35 +1801,154 @@ class ApplicationMessage(discord.ui.View):
 
 # Add application form to current channel | !application_form
 @bot.command()
-@commands.has_permissions(administrator=True)
-@commands.has_role(bot.config['administrator_role_id'])
+@guild_admin()
 async def application_form(interaction: discord.Interaction):
     await interaction.channel.send('Where are you from?', view=ApplicationMessage())
 
 # Clear all applications | !application_clear
 @bot.command()
-@commands.has_permissions(administrator=True)
-@commands.has_role(bot.config['administrator_role_id'])
+@guild_admin()
 async def application_clear(interaction: discord.Interaction):
-    bot.db_cursor.execute('DELETE FROM applications')
-    bot.db_conn.commit()
+    def clear(conn):
+        message_ids = [row['message_id'] for row in conn.execute('SELECT message_id FROM applications WHERE guild_id=?', (interaction.guild.id,))]
+        conn.execute('DELETE FROM applications WHERE guild_id=?', (interaction.guild.id,))
+        return message_ids
+    await delete_admission_messages(interaction.guild.id, await bot.db.write(clear))
     await interaction.channel.send('All applications cleared.')
 
 # Delete a specific application | !application_delete <mention>
 @bot.command()
-@commands.has_permissions(administrator=True)
-@commands.has_role(bot.config['administrator_role_id'])
+@guild_admin()
 async def application_delete(interaction: discord.Interaction, user: discord.User):
     if not isinstance(user, discord.User):
         await interaction.response.send_message('Error: invalid user argument, format: !application_delete <mention>')
         return
-    bot.db_cursor.execute('DELETE FROM applications WHERE user_id=?', (user.id,))
-    bot.db_conn.commit()
+    application = await bot.db.fetchone('SELECT message_id FROM applications WHERE guild_id=? AND user_id=?', (interaction.guild.id, user.id))
+    await bot.db.execute('DELETE FROM applications WHERE guild_id=? AND user_id=?', (interaction.guild.id, user.id))
+    if application:
+        await delete_admission_messages(interaction.guild.id, [application['message_id']])
     await interaction.channel.send(f"Application deleted for user {user.mention}.")
 
+# Delete admission messages in one pass, bulk deletion only works on messages younger than 14 days
+async def delete_admission_messages(guild_id, message_ids):
+    message_ids = [message_id for message_id in message_ids if message_id]
+    if not message_ids:
+        return
+    channel = await bot.resolver.channel((await bot.settings.get(guild_id))['admission_channel_id'])
+    cutoff = discord.utils.utcnow() - timedelta(days=14) + timedelta(minutes=5)
+    recent = [discord.Object(message_id) for message_id in message_ids if discord.utils.snowflake_time(message_id) > cutoff]
+    old = [message_id for message_id in message_ids if discord.utils.snowflake_time(message_id) <= cutoff]
+    for start in range(0, len(recent), 100):
+        try:
+            await channel.delete_messages(recent[start:start + 100])
+        except discord.HTTPException:
+            # Someone already deleted one of them, fall back to deleting one by one
+            old += [message.id for message in recent[start:start + 100]]
+    for message_id in old:
+        try:
+            await channel.get_partial_message(message_id).delete()
+        except discord.NotFound:
+            pass
+
+# Approve or decline every pending application, optionally only those of one FC
+async def process_applications(ctx, status, fc=None):
+    if fc is not None and fc not in FC_ROLES:
+        await ctx.channel.send(f"Error: unknown FC, expected one of: {', '.join(FC_ROLES)}")
+        return
+    if fc is None:
+        applications = await bot.db.fetchall("SELECT * FROM applications WHERE guild_id=?", (ctx.guild.id,))
+    else:
+        applications = await bot.db.fetchall("SELECT * FROM applications WHERE guild_id=? AND fc=?", (ctx.guild.id, fc))
+    if not applications:
+        await ctx.channel.send('No pending applications.')
+        return
+
+    skipped = []
+    if status == 'approved':
+        # Members are resolved in bounded chunks, applicants who left the server stay pending
+        members = await bot.resolver.resolve_members(ctx.guild, [application['user_id'] for application in applications], concurrency=bot.config.get('bulk_concurrency', 8))
+        skipped = [application for application, member in zip(applications, members) if member is None]
+        applications = [application for application, member in zip(applications, members) if member is not None]
+
+    # Everything is resolved in one transaction, the job queue then applies the side effects
+    settings = await bot.settings.get(ctx.guild.id)
+    dedup_prefix = f"bulk:{ctx.message.id}"
+    if status == 'approved':
+        jobs_by_user = {application['user_id']: approval_jobs(settings, application, f"{dedup_prefix}:{application['user_id']}", log=False) for application in applications}
+    else:
+        jobs_by_user = {application['user_id']: decline_jobs(settings, application, f"{dedup_prefix}:{application['user_id']}", log=False) for application in applications}
+    resolved = set(await bot.db.write(lambda conn: resolve_applications(conn, ctx.guild.id, status, jobs_by_user)))
+    bot.jobs.notify()
+    await delete_admission_messages(ctx.guild.id, [application['message_id'] for application in applications if application['user_id'] in resolved])
+
+    lines = [f"<@{application['user_id']}> | {application['ingame_name']} | {application['fc']}" for application in applications if application['user_id'] in resolved]
+    lines += [f"<@{application['user_id']}> | {application['ingame_name']} | {application['fc']} | not in the server, left pending" for application in skipped]
+    embeds = paginate_embeds(f"Applications {status}", lines, 0x5d3fd3, header=f"{len(resolved)} applications {status} by {ctx.author.mention}")
+    if settings.get('logs_channel_id'):
+        await send_embeds(await bot.resolver.channel(settings['logs_channel_id']), embeds)
+    await ctx.channel.send(f"{len(resolved)} applications {status}" + (f", {len(skipped)} skipped" if skipped else '') + '.')
+
+# Approve all pending applications | !application_approve_all [fc]
+@bot.command()
+@guild_admin()
+async def application_approve_all(interaction: discord.Interaction, *, fc: str = None):
+    await process_applications(interaction, 'approved', fc)
+
+# Decline all pending applications | !application_decline_all [fc]
+@bot.command()
+@guild_admin()
+async def application_decline_all(interaction: discord.Interaction, *, fc: str = None):
+    await process_applications(interaction, 'declined', fc)
+
+# Page through prepared embeds, only for whoever ran the command
+class PagesView(discord.ui.View):
+    def __init__(self, author_id, embeds, timeout=300):
+        super().__init__(timeout=timeout)
+        self.author_id = author_id
+        self.embeds = embeds
+        self.page = 0
+        self.update_buttons()
+
+    def update_buttons(self):
+        self.previous_button.disabled = self.page == 0
+        self.next_button.disabled = self.page == len(self.embeds) - 1
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("You don't have permission to use this button.", ephemeral=True)
+            return False
+        return True
+
+    async def turn(self, interaction, step):
+        self.page += step
+        self.update_buttons()
+        await interaction.response.edit_message(embed=self.embeds[self.page], view=self)
+
+    @discord.ui.button(label='Previous', style=discord.ButtonStyle.grey)
+    async def previous_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.turn(interaction, -1)
+
+    @discord.ui.button(label='Next', style=discord.ButtonStyle.grey)
+    async def next_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.turn(interaction, 1)
+
+# List pending applications | !application_pending [fc]
+@bot.command()
+@guild_admin()
+async def application_pending(interaction: discord.Interaction, *, fc: str = None):
+    if fc is None:
+        applications = await bot.db.fetchall("SELECT * FROM applications WHERE guild_id=?", (interaction.guild.id,))
+    else:
+        applications = await bot.db.fetchall("SELECT * FROM applications WHERE guild_id=? AND fc=?", (interaction.guild.id, fc))
+    lines = [f"<@{application['user_id']}> | {application['ingame_name']} | {application['fc']}" for application in applications]
+    embeds = paginate_embeds('Pending applications', lines or ['No pending applications.'], 0x5d3fd3, header=f"{len(applications)} pending")
+    if len(embeds) == 1:
+        await interaction.channel.send(embed=embeds[0])
+    else:
+        await interaction.channel.send(embed=embeds[0], view=PagesView(interaction.author.id, embeds))
+
 # List guild's emojis ids
-@commands.has_permissions(administrator=True)
-@commands.has_role(bot.config['administrator_role_id'])
+@guild_admin()
 @bot.command()
 async def get_guild_emojis(interaction: discord.Interaction):
     emojis = [f"{emoji} | {emoji.name} | {emoji.id}" for emoji in interaction.guild.emojis]
@@ -303,97 +1957,234 @@ async def get_guild_emojis(interaction: discord.Interaction):
     else:
         await interaction.channel.send("No emojis found in this server.")
 
-# Translate english dyes in french using | as a separator
+# Show this guild's settings | !settings
+@bot.command(name='settings')
+@guild_admin()
+async def settings_show(interaction: discord.Interaction):
+    settings = await bot.settings.get(interaction.guild.id)
+    lines = []
+    for key in GUILD_SETTINGS:
+        value = settings.get(key)
+        if value is None:
+            lines.append(f"`{key}` not set")
+        else:
+            lines.append(f"`{key}` {f'<#{value}>' if key.endswith('_channel_id') else f'<@&{value}>'} ({value})")
+    await interaction.channel.send(embed=discord.Embed(title='Moogly settings', description='\n'.join(lines), color=0x5d3fd3))
+
+# Change one of this guild's settings, "none" unsets it and "default" goes back to config.json's value | !settings_set <key> <role or channel>
 @bot.command()
-async def translate_dyes_fr(interaction: discord.Interaction, *args):
-    # Split the input arguments
-    arguments = ''.join(args)
-    dyes = arguments.split('|')
-    
-    # Count occurrences of each translated dye name
-    dye_counts = {}
-    for dye_name in dyes:
-        for dye_entry in bot.dyes_fr:
-            if dye_entry["original_name"].replace(" ", "") == dye_name.strip():
-                translated_name = dye_entry["translated_name"]
-                dye_counts[translated_name] = dye_counts.get(translated_name, 0) + 1
-                break
-    
-    # Create an embed to display the results
-    embed = discord.Embed(
-        title="Translated dyes (french)",
-        color=0x5d3fd3
-    )
-    for translated_name, count in dye_counts.items():
-        original_name = [entry["original_name"] for entry in bot.dyes_fr if entry["translated_name"] == translated_name][0]
-        embed.add_field(name=f"{count}x {translated_name}", value=f"({original_name})", inline=False)
+@guild_admin()
+async def settings_set(interaction: discord.Interaction, key: str, value: str):
+    if key not in GUILD_SETTINGS:
+        await interaction.channel.send(f"Error: unknown setting, expected one of: {', '.join(GUILD_SETTINGS)}")
+        return
+    if value.lower() == 'default':
+        await bot.settings.reset(interaction.guild.id, key)
+        current = (await bot.settings.get(interaction.guild.id)).get(key)
+        await interaction.channel.send(f"`{key}` reset to {current if current is not None else 'not set'}.")
+        return
+    if value.lower() == 'none':
+        snowflake = None
+    else:
+        match = re.fullmatch(r'<[#@]&?(\d+)>|(\d+)', value)
+        if not match:
+            await interaction.channel.send('Error: expected a role or channel mention, an id, none or default')
+            return
+        snowflake = int(match.group(1) or match.group(2))
+        exists = interaction.guild.get_channel(snowflake) if key.endswith('_channel_id') else interaction.guild.get_role(snowflake)
+        if exists is None:
+            await interaction.channel.send(f"Error: {value} is not a {'channel' if key.endswith('_channel_id') else 'role'} of this server")
+            return
+    await bot.settings.set(interaction.guild.id, key, snowflake)
+    if snowflake is not None and key.endswith('_channel_id'):
+        await bot.resolver.pin_channels([snowflake])
+    await interaction.channel.send(f"`{key}` set to {value}.")
 
+# Show handler latencies, rate limits and queue depths | !stats
+@bot.command()
+@guild_admin()
+async def stats(interaction: discord.Interaction):
+    metrics = bot.metrics
+    embed = discord.Embed(title="Moogly stats", color=0x5d3fd3)
+
+    sections = {
+        'moogly_interaction_seconds': 'Interactions',
+        'moogly_interaction_background_seconds': 'Interactions (background)',
+        'moogly_command_seconds': 'Commands',
+        'moogly_db_seconds': 'Database',
+        'moogly_rest_seconds': 'REST calls',
+        'moogly_job_seconds': 'Jobs',
+    }
+    for name, title in sections.items():
+        # Slowest first by total time spent
+        histograms = sorted(
+            [(labels, histogram) for (metric, labels), histogram in metrics.histograms.items() if metric == name],
+            key=lambda item: -item[1][-1]
+        )
+        lines = []
+        for labels, histogram in histograms[:8]:
+            count = sum(histogram[:-1])
+            label = ' '.join(str(value) for _, value in labels)
+            lines.append(f"`{label}` {count}x avg {histogram[-1] / count * 1000:.0f}ms p99 ≤{metrics.quantile(histogram, 0.99) * 1000:.0f}ms")
+        if lines:
+            embed.add_field(name=title, value='\n'.join(lines)[:1024], inline=False)
+
+    counters = [f"`{' '.join([name] + [str(value) for _, value in labels])}` {count}" for (name, labels), count in sorted(metrics.counters.items())]
+    gauges = [f"`{name}` {value() if callable(value) else round(value, 4)}" for (name, labels), value in sorted(metrics.gauges.items())]
+    if counters:
+        embed.add_field(name='Counters', value='\n'.join(counters)[:1024], inline=False)
+    embed.add_field(name='Gauges', value='\n'.join(gauges)[:1024] or 'None', inline=False)
     await interaction.channel.send(embed=embed)
 
-class MapsRunView(discord.ui.View):
-    def __init__(self, message_id, timestamp, description, available_slots):
-        super().__init__(timeout=None)
+LANGUAGE_NAMES = {'fr': 'french', 'de': 'german', 'ja': 'japanese', 'en': 'english'}
+
+# Translate dyes using | or new lines as a separator, names can also be sent as an attached text file | !translate_dyes <lang> <dyes>
+@bot.command()
+async def translate_dyes(interaction: discord.Interaction, lang: str, *args):
+    dye_index = bot.dyes.get(lang.lower())
+    if dye_index is None:
+        await interaction.channel.send(f"Unknown language, available languages: {', '.join(bot.dyes)}")
+        return
+
+    # Fuzzy matching costs a few milliseconds per unknown name, so the input is bounded
+    # and translated off the event loop
+    max_bytes = bot.config.get('translate_dyes_max_bytes', 65536)
+    max_names = bot.config.get('translate_dyes_max_names', 1000)
+    text = ' '.join(args)
+    for attachment in interaction.message.attachments:
+        if attachment.size > max_bytes:
+            await interaction.channel.send(f"{attachment.filename} is too large, attachments are limited to {max_bytes // 1024} KB.")
+            return
+        text += '\n' + (await attachment.read()).decode('utf-8', errors='ignore')
+    names = re.split(r'[|\n]', text)
+    if len(names) > max_names:
+        await interaction.channel.send(f"Too many dyes, at most {max_names} can be translated at once.")
+        return
+    dye_counts, unknown = await asyncio.to_thread(dye_index.translate, names)
+
+    # Embeds are limited to 25 fields and a message to 10 embeds
+    embeds = []
+    for index, ((name, counterpart), count) in enumerate(dye_counts.items()):
+        if index % 25 == 0:
+            embeds.append(discord.Embed(
+                title=f"Translated dyes ({LANGUAGE_NAMES.get(dye_index.lang, dye_index.lang)})",
+                color=0x5d3fd3
+            ))
+        embeds[-1].add_field(name=f"{count}x {name}", value=f"({counterpart})", inline=False)
+    if not embeds:
+        embeds.append(discord.Embed(title=f"Translated dyes ({LANGUAGE_NAMES.get(dye_index.lang, dye_index.lang)})", color=0x5d3fd3))
+    if unknown:
+        embeds[-1].set_footer(text=f"Unknown dyes: {', '.join(unknown)}"[:2048])
+
+    for start in range(0, len(embeds), 10):
+        await interaction.channel.send(embeds=embeds[start:start + 10])
+
+# Translate english dyes in french | !translate_dyes_fr <dyes>
+@bot.command()
+async def translate_dyes_fr(interaction: discord.Interaction, *args):
+    await translate_dyes(interaction, 'fr', *args)
+
+# State of a maps run, held by MapsRunStore. timestamp is the Discord timestamp
+# markup shown in the embed, starts_at the same time in seconds.
+class MapsRun:
+    __slots__ = ('message_id', 'guild_id', 'timestamp', 'starts_at', 'description', 'available_slots', 'pinged', 'participants')
+
+    def __init__(self, message_id, guild_id, timestamp, starts_at, description, available_slots=8, pinged=0, participants=None):
         self.message_id = message_id
+        self.guild_id = guild_id
         self.timestamp = timestamp
+        self.starts_at = starts_at
         self.description = description
         self.available_slots = available_slots
-        self.embed = discord.Embed()
-        self.update_embed()
-
-    def update_embed(self):
-        # Fetch joined users
-        bot.db_cursor.execute('SELECT user_ids FROM maps_runs WHERE message_id=?', (self.message_id,))
-        maps_run = bot.db_cursor.fetchone()
-    
-        if maps_run and maps_run[0]:
-            joined_user_ids = maps_run[0].split(',')
-            joined_users = [f"<@{user_id}>" for user_id in joined_user_ids if user_id]
+        self.pinged = pinged
+        # user_id -> joined_at, in join order
+        self.participants = dict(participants or {})
+
+    @classmethod
+    def from_row(cls, row, participants):
+        return cls(row['message_id'], row['guild_id'], row['discord_timestamp'], row['timestamp'], row['message'], row['available_slots'], row['pinged'], participants)
+
+    @classmethod
+    def load(cls, conn, message_id):
+        maps_run = conn.execute('SELECT * FROM maps_runs WHERE message_id=?', (message_id,)).fetchone()
+        if not maps_run:
+            return None
+        participants = conn.execute('SELECT user_id, joined_at FROM maps_run_participants WHERE message_id=? ORDER BY joined_at, rowid', (message_id,)).fetchall()
+        return cls.from_row(maps_run, [(row['user_id'], row['joined_at']) for row in participants])
+
+    # Every run still open to joins, with their participants, in two queries
+    @classmethod
+    def load_active(cls, conn):
+        participants = {}
+        for row in conn.execute('SELECT p.message_id, p.user_id, p.joined_at FROM maps_run_participants p JOIN maps_runs r ON r.message_id = p.message_id WHERE r.pinged=0 ORDER BY p.joined_at, p.rowid'):
+            participants.setdefault(row['message_id'], []).append((row['user_id'], row['joined_at']))
+        return [cls.from_row(row, participants.get(row['message_id'])) for row in conn.execute('SELECT * FROM maps_runs WHERE pinged=0')]
+
+    def join(self, user_id):
+        if user_id in self.participants:
+            return 'already_joined'
+        if self.pinged != 0:
+            return 'closed'
+        if self.available_slots <= 0:
+            return 'full'
+        self.available_slots -= 1
+        self.participants[user_id] = datetime.now(timezone.utc).timestamp()
+        return 'joined'
+
+    def embed(self):
+        if self.participants:
+            joined_users = [f"<@{user_id}>" for user_id in self.participants]
             joined_users_description = "\n\n**Joined users**:\n" + "\n".join(joined_users)
         else:
             joined_users_description = ""
 
-        self.embed = discord.Embed(
+        return discord.Embed(
             title="Treasure Maps run 🧭",
             description=f"{self.description}\nNext maps run on {self.timestamp}\nWho's in? 💰\nCurrently available slots: **{self.available_slots} / 8{joined_users_description}**",
             color=0xffc100
         )
 
+    def render(self):
+        return {'embed': self.embed()}
+
+# Join button of every maps run message, the run is identified by the message it is attached to
+class MapsRunView(discord.ui.View):
+    def __init__(self):
+        super().__init__(timeout=None)
+
     @discord.ui.button(label="Join", style=discord.ButtonStyle.green, custom_id="join_map_run")
+    @instrumented
     async def join_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         user_id = interaction.user.id
+        message_id = interaction.message.id
 
-        bot.db_cursor.execute('SELECT * FROM maps_runs WHERE message_id=?', (self.message_id,))
-        maps_run = bot.db_cursor.fetchone()
-
-        if maps_run:
-            user_ids = maps_run[5].split(',')
-            if str(user_id) not in user_ids:
-                if self.available_slots > 0:
-                    if maps_run[6] == 0: # Check if ping was already sent, meaning that the map will be running soon
-                        user_ids.append(str(user_id))
-                        self.available_slots -= 1
-                        bot.db_cursor.execute(
-                            'UPDATE maps_runs SET user_ids=?, available_slots=? WHERE message_id=?',
-                            (','.join(user_ids), self.available_slots, self.message_id)
-                        )
-                        bot.db_conn.commit()
-
-                        self.update_embed()
-                        await interaction.message.edit(embed=self.embed, view=self)
-                        await interaction.response.send_message('You have successfully joined the map run! You will be pinged 20 minutes before the maps run starts.', ephemeral=True)
-                    else:
-                        await interaction.response.send_message('The map run is starting soon. You cannot join now.', ephemeral=True)
-                else:
-                    await interaction.response.send_message('Sorry, no more available slots for this map run.', ephemeral=True)
-            else:
-                await interaction.response.send_message('You have already joined this map run.', ephemeral=True)
+        # Served from memory, the join is written to the database in the background
+        maps_run = await bot.maps_runs.get(message_id)
+        if maps_run is None:
+            await interaction.response.send_message('Error: this maps run no longer exists.', ephemeral=True)
+            return
+
+        status = bot.maps_runs.join(maps_run, user_id)
+
+        if status == 'joined':
+            await interaction.response.send_message(f'You have successfully joined the map run! You will be pinged {bot.reminder_offsets_text()} minutes before the maps run starts.', ephemeral=True)
+            bot.embed_updates.request(interaction.message, maps_run.render)
+        elif status == 'already_joined':
+            await interaction.response.send_message('You have already joined this map run.', ephemeral=True)
+        elif status == 'closed': # Ping was already sent, meaning that the map will be running soon
+            await interaction.response.send_message('The map run is starting soon. You cannot join now.', ephemeral=True)
+        elif status == 'full':
+            await interaction.response.send_message('Sorry, no more available slots for this map run.', ephemeral=True)
 
 # Create a new map run message | !maps_create <timestamp>
 @bot.command()
-@commands.has_permissions(administrator=True)
-@commands.has_role(bot.config['administrator_role_id'])
+@guild_admin()
 async def maps_create(interaction: discord.Interaction, timestamp: str, *args):
-    channel = await bot.fetch_channel(bot.config['events_channel_id'])
+    settings = await bot.settings.get(interaction.guild.id)
+    if not settings.get('events_channel_id'):
+        await interaction.channel.send('Error: no events channel configured, use !settings_set events_channel_id <channel>')
+        return
+    channel = await bot.resolver.channel(settings['events_channel_id'])
 
     # Check if the timestamp is valid
     try:
@@ -408,55 +2199,34 @@ async def maps_create(interaction: discord.Interaction, timestamp: str, *args):
     # Enforce the timestamp to be in full format by replacing characters after the last ':' with 'F'
     new_timestamp = f"{timestamp.rsplit(':', 1)[0]}:F>"
 
-    view = MapsRunView(message_id=None, timestamp=new_timestamp, message=msg, available_slots=8)
-    message = await channel.send(f"<@&{bot.config['maps_notifications_role_id']}>", embed=view.embed, view=view)
-
-    # Update the message_id in the view
-    view.message_id = message.id
+    maps_run = MapsRun(message_id=None, guild_id=interaction.guild.id, timestamp=new_timestamp, starts_at=timestamp_dt.timestamp(), description=msg)
+    message = await channel.send(f"<@&{settings['maps_notifications_role_id']}>", embed=maps_run.embed(), view=MapsRunView())
+    maps_run.message_id = message.id
 
     # Store the message info in the database
-    bot.db_cursor.execute(
-        'INSERT INTO maps_runs (message_id, discord_timestamp, timestamp, message, available_slots, user_ids, pinged) VALUES (?, ?, ?, ?, ?, ?, ?)',
-        (int(message.id), new_timestamp, timestamp_dt.timestamp(), msg, 8, '', 0)
+    await bot.db.execute(
+        'INSERT INTO maps_runs (message_id, discord_timestamp, timestamp, message, available_slots, pinged, guild_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (int(message.id), new_timestamp, timestamp_dt.timestamp(), msg, 8, 0, interaction.guild.id)
     )
-    bot.db_conn.commit()
-
-    # Update the embed with the joined users
-    view.update_embed()
-    await message.edit(embed=view.embed, view=view)
+    bot.maps_runs.add(maps_run)
+    await bot.schedule_reminders(int(message.id), timestamp_dt.timestamp())
 
 # Outputs a list of users who have joined the map run | !maps_list <timestamp>
 @bot.command()
-@commands.has_permissions(administrator=True)
-@commands.has_role(bot.config['administrator_role_id'])
+@guild_admin()
 async def maps_list(interaction: discord.Interaction, message_id: int):
-    # Fetch the message
-    channel = await bot.fetch_channel(bot.config['events_channel_id'])
-    try:
-        message = await channel.fetch_message(message_id)
-    except discord.NotFound:
-        await interaction.channel.send('Message not found.')
-        return
-
     # Check if the message is a map run message
-    bot.db_cursor.execute('SELECT * FROM maps_runs WHERE message_id=?', (message_id,))
-    maps_run = bot.db_cursor.fetchone()
-    if not maps_run:
+    maps_run = await bot.maps_runs.get(message_id)
+    if not maps_run or maps_run.guild_id != interaction.guild.id:
         await interaction.channel.send('Message is not a maps run message.')
         return
 
-    # Fetch joined users
-    joined_user_ids = maps_run[5].split(',')
-    joined_users = [await interaction.guild.fetch_member(int(user_id)).mention for user_id in joined_user_ids if user_id]
-
-    # Create an embed with the joined users
-    embed = discord.Embed(
-        title="Joined Users",
-        description="\n".join(joined_users) if joined_users else "No users have joined yet.",
-        color=0x5d3fd3
-    )
+    # Resolve every joined user at once
+    joined_users = await build_roster(interaction.guild, list(maps_run.participants))
 
-    await interaction.channel.send(embed=embed)
+    embeds = paginate_embeds("Joined Users", joined_users or ["No users have joined yet."], 0x5d3fd3)
+    await send_embeds(interaction.channel, embeds)
 
 # Run the bot
-bot.run(bot.config['token'])
+if __name__ == '__main__':
+    bot.run(bot.config['token'])